@@ -0,0 +1,124 @@
+"""
+Micro-benchmarks of the in-memory aggregation paths on a synthetic chain, with peak memory.
+
+    python3 -m benchmarks.bench_aggregation --miners 10000 --blocks 10000000 --output aggregation.json
+
+Phases:
+    add_block               ChainDataFetcher.apply_blocks of every epoch, i.e. Miner.add_block through the MinerStore
+    activate                Miner.activate of every miner
+    miner_list              ChainDataFetcher.miner_list
+    miner_block_timestamps  the uncached histogram of the top, median and last miner by rank
+
+Every phase reports the process peak RSS once it is done. With --trace-memory it also reports the peak memory it
+allocated, traced with tracemalloc, which makes the timings several times slower.
+"""
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic_chain import SyntheticChain
+from chain_data_fetcher import ChainDataFetcher
+
+
+class Phase:
+    def __init__(self, name, results, trace_memory):
+        self.name = name
+        self.results = results
+        self.trace_memory = trace_memory
+        self.result = {}
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        return self.result
+
+    def __exit__(self, *exc):
+        if self.trace_memory:
+            self.result["traced_peak_mib"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            tracemalloc.stop()
+        # ru_maxrss is in KiB on Linux.
+        self.result["peak_rss_mib"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        self.results[self.name] = self.result
+        print(f"{self.name:<24} " + "  ".join(f"{key}={value}" for key, value in self.result.items()
+                                              if not isinstance(value, (dict, list))))
+
+
+def time_calls(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {"min_ms": round(min(timings) * 1000, 3), "mean_ms": round(sum(timings) / len(timings) * 1000, 3)}
+
+
+def run(chain, repeat, trace_memory):
+    results = {}
+    fetcher = ChainDataFetcher()
+
+    with Phase("add_block", results, trace_memory) as result:
+        elapsed = 0
+        for epoch, blocks in chain.epochs():
+            start = time.perf_counter()
+            fetcher.apply_blocks(epoch, list(blocks), blocks)
+            elapsed += time.perf_counter() - start
+        result["seconds"] = round(elapsed, 3)
+        result["blocks_per_second"] = round(chain.blocks / elapsed)
+
+    with Phase("activate", results, trace_memory) as result:
+        start = time.perf_counter()
+        for campaign in fetcher.campaigns.values():
+            campaign.miners.activate_all()
+        result["seconds"] = round(time.perf_counter() - start, 3)
+    fetcher.activated = True
+
+    with Phase("miner_list", results, trace_memory) as result:
+        result.update(time_calls(fetcher.miner_list, repeat))
+        result["miners"] = sum(len(shard.miners) for shard in fetcher.miners.shards)
+
+    with Phase("miner_block_timestamps", results, trace_memory) as result:
+        ranks = {}
+        for label, rank in (("top", 0), ("median", chain.miners // 2), ("last", chain.miners - 1)):
+            address = chain.addresses[rank]
+            shard = fetcher.miners.shard_of(address)
+            if address not in shard.miners:
+                continue
+            # Bypass the request coalescing cache, which would answer repeated calls.
+            ranks[label] = dict(time_calls(lambda: fetcher._miner_block_timestamps(shard, address, None), repeat),
+                                blocks=len(shard.miners[address].all_timestamps))
+            print(f"    {label:<8} {ranks[label]}")
+        result["ranks"] = ranks
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--miners", type=int, default=10000)
+    parser.add_argument("--blocks", type=int, default=10000000)
+    parser.add_argument("--blocks-per-epoch", type=int, default=5)
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of the miner distribution")
+    parser.add_argument("--disorder", type=int, default=64, help="epochs are shuffled within windows of this size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="calls per query benchmark")
+    parser.add_argument("--trace-memory", action="store_true")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    chain = SyntheticChain(miners=args.miners, blocks=args.blocks, blocks_per_epoch=args.blocks_per_epoch,
+                           skew=args.skew, disorder=args.disorder, seed=args.seed)
+    output = os.path.abspath(args.output) if args.output else None
+    # ChainDataFetcher opens its databases in the working directory.
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench_aggregation_") as work_dir:
+        os.chdir(work_dir)
+        results = run(chain, args.repeat, args.trace_memory)
+        os.chdir(cwd)
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump({"config": {key: value for key, value in vars(args).items() if key != "output"},
+                       "phases": results}, f, indent=2)
+        print(f"wrote {output}")
@@ -0,0 +1,72 @@
+"""
+Compare throughput and latency of the uwsgi + XML-RPC front end with the built-in async one.
+
+Start a fetcher with HTTP_FRONTEND=both so that uwsgi serves PUBLIC_PORT and the built-in server serves
+ASYNC_PUBLIC_PORT from the same state, then:
+
+    python3 -m benchmarks.bench_http_frontend --target uwsgi=http://localhost:4000 \
+        --target async=http://localhost:4100 --path /get-miner-list \
+        --path "/get-mined-block-timestamps?address=<address without 0x>" --clients 32 --duration 20
+"""
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def run_client(host, port, paths, deadline, latencies, errors):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def run(name, url, paths, clients, duration):
+    url = urlsplit(url)
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=run_client, args=(url.hostname, url.port or 80, paths, deadline,
+                                                         latencies, errors))
+               for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0
+    print(f"{name:<8} {len(latencies) / elapsed:>9.0f} req/s  p50 {percentile(0.5):8.2f}ms  "
+          f"p99 {percentile(0.99):8.2f}ms  errors {len(errors)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", action="append", required=True, help="name=base url, can be repeated")
+    parser.add_argument("--path", action="append", required=True, help="request path, can be repeated")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent keep-alive connections")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per target")
+    args = parser.parse_args()
+    for target in args.target:
+        name, _, url = target.partition("=")
+        run(name, url, args.path, args.clients, args.duration)
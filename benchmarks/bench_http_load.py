@@ -0,0 +1,311 @@
+"""
+Load-test the public endpoints of both services and write the results as JSON.
+
+The services are booted in this process against synthetic stand-in data: a ChainDataFetcher fed with generated blocks
+and the node status state filled with generated trusted nodes, each with its XML-RPC server. Their HTTP front end is
+either uwsgi with the Flask apps reading the published snapshots, as deployed, or the built-in async server.
+
+    python3 -m benchmarks.bench_http_load --frontend uwsgi --clients 1 8 32 --duration 10 \
+        --mix miner-list=1 block-timestamps=4 trusted-node-list=1 node-status=4 --output load.json
+
+Pass --chain-url and/or --node-url to load already running services instead of booting them.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import chain_data_fetcher
+import node_status_fetcher
+from benchmarks.synthetic_chain import SyntheticChain
+from chain_data_fetcher import ChainDataFetcher
+from utils.mmap_snapshot import write_snapshot
+from utils.node_endpoint import NodeEndpoint
+from utils.node_key import derive_node_id
+from utils.timestamp_index import TimestampIndex
+from utils.uptime import UptimeHistory
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ["miner-list", "block-timestamps", "trusted-node-list", "node-status"]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"nothing is listening on port {port} after {timeout}s")
+
+
+def start_uwsgi(module, public_port, local_port, snapshot_file, processes, work_dir):
+    env = dict(os.environ, LOCAL_PORT=str(local_port), SNAPSHOT_FILE=snapshot_file,
+               PYTHONPATH=os.pathsep.join([REPO_DIR, os.environ.get("PYTHONPATH", "")]))
+    process = subprocess.Popen(["uwsgi", "--master", "--http", f"127.0.0.1:{public_port}", "--module", module,
+                                "--threads", "8", "--processes", str(processes), "--disable-logging"],
+                               cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return process
+
+
+def boot_chain_service(args, work_dir):
+    """Feed a ChainDataFetcher with generated blocks and serve it. Return the miner addresses and the process to stop."""
+    fetcher = ChainDataFetcher()
+    chain = SyntheticChain(miners=args.miners, blocks=args.blocks, blocks_per_epoch=args.blocks_per_epoch, seed=args.seed)
+    for epoch, blocks in chain.epochs():
+        fetcher.apply_blocks(epoch, list(blocks), blocks)
+    for campaign in fetcher.campaigns.values():
+        campaign.miners.activate_all()
+    fetcher.activated = True
+
+    chain_data_fetcher.chain_data_fetcher = fetcher
+    chain_data_fetcher.LOCAL_PORT = args.chain_port + 5000
+    threading.Thread(target=chain_data_fetcher.start_rpc_server, daemon=True).start()
+    process = None
+    if args.frontend == "async":
+        chain_data_fetcher.async_http_server(args.chain_port).start()
+    else:
+        snapshot_file = os.path.join(work_dir, "miner_snapshot.bin")
+        write_snapshot(snapshot_file, fetcher.snapshot_blobs(), 1)
+        # Keeps the snapshot current for the readers, as in the service.
+        fetcher.snapshot_path = snapshot_file
+        threading.Thread(target=fetcher.snapshot_loop, daemon=True).start()
+        process = start_uwsgi("http_server:app", args.chain_port, chain_data_fetcher.LOCAL_PORT, snapshot_file,
+                              args.processes, work_dir)
+    wait_for_port(args.chain_port)
+    return [address[2:] for address in chain.addresses], process
+
+
+def keep_publishing(publish):
+    while True:
+        time.sleep(node_status_fetcher.SNAPSHOT_INTERVAL_SECONDS)
+        publish()
+
+
+def boot_node_service(args, work_dir, rng):
+    """Fill the node status state with generated trusted nodes and serve it. Return their keys and the process to stop."""
+    keys = [f"{rng.getrandbits(255) + 1:064x}" for _ in range(args.nodes)]
+    nsf = node_status_fetcher
+    nsf._lock = threading.Lock()
+    nsf.nodes_map = {}
+    nsf.trusted_nodes_time = {}
+    nsf.latest_alive_nodes = {}
+    nsf.udp_alive_nodes = set()
+    for i, key in enumerate(keys):
+        node = NodeEndpoint(derive_node_id(key), f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", 32323, 32323)
+        node_id = node.raw_id
+        nsf.nodes_map[node_id] = node
+        nsf.trusted_nodes_time[node_id] = rng.uniform(0, 30 * 24 * 3600)
+        if rng.random() < 0.8:
+            nsf.latest_alive_nodes[node_id] = node
+        if rng.random() < 0.7:
+            nsf.udp_alive_nodes.add(node_id)
+    nsf.uptime_history = UptimeHistory(3600)
+    nsf.alive_ts_index = TimestampIndex()
+    nsf.alive_node_db = {}
+    nsf.state_version = 1
+    nsf.cached_responses = (-1, {}, {})
+    nsf.refresh_responses()
+
+    nsf.LOCAL_PORT = args.node_port + 5000
+    threading.Thread(target=nsf.start_rpc_server, daemon=True).start()
+    process = None
+    if args.frontend == "async":
+        nsf.async_http_server(args.node_port).start()
+    else:
+        nsf.snapshot_path = os.path.join(work_dir, "node_snapshot.bin")
+        nsf.published_version = -1
+        nsf.publish_snapshot()
+        threading.Thread(target=keep_publishing, args=(nsf.publish_snapshot,), daemon=True).start()
+        process = start_uwsgi("trust_node_server:app", args.node_port, nsf.LOCAL_PORT, nsf.snapshot_path,
+                              args.processes, work_dir)
+    wait_for_port(args.node_port)
+    return keys, process
+
+
+class RequestMix:
+    """Pick requests by endpoint weight. A tenth of the node status requests use keys of unknown nodes."""
+    def __init__(self, weights, chain_url, node_url, addresses, keys):
+        self.endpoints = [name for name in ENDPOINTS if weights.get(name, 0) > 0]
+        self.weights = [weights[name] for name in self.endpoints]
+        self.chain = urlsplit(chain_url)
+        self.node = urlsplit(node_url)
+        self.addresses = addresses or [f"{0:040x}"]
+        self.keys = keys or [f"{1:064x}"]
+
+    def pick(self, rng):
+        """Return (endpoint name, url, path)."""
+        name = rng.choices(self.endpoints, self.weights)[0]
+        if name == "miner-list":
+            return name, self.chain, "/get-miner-list"
+        if name == "block-timestamps":
+            # Skewed towards the most active miners, which come first, like the generated blocks.
+            address = self.addresses[min(int(rng.paretovariate(1)) - 1, len(self.addresses) - 1)]
+            return name, self.chain, f"/get-mined-block-timestamps?address={address}"
+        if name == "trusted-node-list":
+            return name, self.node, "/trusted-node-list"
+        key = rng.choice(self.keys) if rng.random() >= 0.1 else f"{rng.getrandbits(255) + 1:064x}"
+        return name, self.node, f"/node-status-from-net-key?key={key}"
+
+
+def get(conns, url, path):
+    """Return the status of GET `path`, reusing the connection to `url` if there is one."""
+    conn = conns.get(url.netloc)
+    if conn is None:
+        conn = conns[url.netloc] = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+    try:
+        conn.request("GET", path)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    except (OSError, http.client.HTTPException):
+        conn.close()
+        del conns[url.netloc]
+        raise
+
+
+def run_client(mix, seed, deadline, results):
+    rng = random.Random(seed)
+    conns = {}
+    while time.perf_counter() < deadline:
+        name, url, path = mix.pick(rng)
+        reused = url.netloc in conns
+        start = time.perf_counter()
+        try:
+            try:
+                status = get(conns, url, path)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The uwsgi HTTP router closes connections after each response without saying so. Like any HTTP
+                # client, retry once on a new connection, and time the request from there.
+                if not reused:
+                    raise
+                start = time.perf_counter()
+                status = get(conns, url, path)
+            ok = status < 400
+        except (OSError, http.client.HTTPException):
+            ok = False
+        latencies, errors = results[name]
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(1)
+    for conn in conns.values():
+        conn.close()
+
+
+def summarize(latencies, error_count, elapsed):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3) if latencies else None
+    return {
+        "requests": len(latencies),
+        "errors": error_count,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def run_level(mix, clients, duration, seed):
+    results = {name: ([], []) for name in mix.endpoints}
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=run_client, args=(mix, seed * 1000 + i, deadline, results))
+               for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    endpoints = {name: summarize(latencies, len(errors), elapsed) for name, (latencies, errors) in results.items()}
+    total = summarize([l for latencies, _ in results.values() for l in latencies],
+                      sum(len(errors) for _, errors in results.values()), elapsed)
+    return {"clients": clients, "duration": round(elapsed, 3), "total": total, "endpoints": endpoints}
+
+
+def parse_mix(items):
+    weights = {}
+    for item in items:
+        name, _, weight = item.partition("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"unknown endpoint {name}, expected one of {ENDPOINTS}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frontend", choices=["uwsgi", "async"], default="uwsgi")
+    parser.add_argument("--processes", type=int, default=4, help="uwsgi worker processes per service")
+    parser.add_argument("--chain-url", help="load this chain data service instead of booting one")
+    parser.add_argument("--node-url", help="load this node status service instead of booting one")
+    parser.add_argument("--chain-port", type=int, default=14000)
+    parser.add_argument("--node-port", type=int, default=14002)
+    parser.add_argument("--miners", type=int, default=2000)
+    parser.add_argument("--blocks", type=int, default=200000)
+    parser.add_argument("--blocks-per-epoch", type=int, default=5)
+    parser.add_argument("--nodes", type=int, default=2000)
+    parser.add_argument("--mix", nargs="+", default=[f"{name}=1" for name in ENDPOINTS],
+                        help="endpoint=weight, endpoints: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32], help="concurrency levels to run")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per concurrency level")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="load_test.json")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    output = os.path.abspath(args.output)
+    work_dir = tempfile.mkdtemp(prefix="load_test_")
+    # The stand-in fetcher opens its databases in the working directory.
+    os.chdir(work_dir)
+    processes = []
+    addresses = []
+    keys = []
+    chain_url = args.chain_url
+    node_url = args.node_url
+    try:
+        if chain_url is None and (weights.get("miner-list") or weights.get("block-timestamps")):
+            print(f"booting chain data service: {args.miners} miners, {args.blocks} blocks", file=sys.stderr)
+            addresses, process = boot_chain_service(args, work_dir)
+            processes.append(process)
+            chain_url = f"http://127.0.0.1:{args.chain_port}"
+        if node_url is None and (weights.get("trusted-node-list") or weights.get("node-status")):
+            print(f"booting node status service: {args.nodes} nodes", file=sys.stderr)
+            keys, process = boot_node_service(args, work_dir, rng)
+            processes.append(process)
+            node_url = f"http://127.0.0.1:{args.node_port}"
+        mix = RequestMix(weights, chain_url or "http://127.0.0.1", node_url or "http://127.0.0.1", addresses, keys)
+        started_at = int(time.time())
+        runs = []
+        for clients in args.clients:
+            run = run_level(mix, clients, args.duration, args.seed)
+            runs.append(run)
+            total = run["total"]
+            print(f"clients={clients:<4} {total['rps']:>9.1f} req/s  p50 {total['p50_ms']}ms  "
+                  f"p95 {total['p95_ms']}ms  p99 {total['p99_ms']}ms  errors {total['errors']}")
+        with open(output, "w") as f:
+            json.dump({
+                "config": {key: value for key, value in vars(args).items() if key != "output"},
+                "started_at": started_at,
+                "runs": runs,
+            }, f, indent=2)
+        print(f"wrote {output}")
+    finally:
+        for process in processes:
+            if process is not None:
+                # SIGTERM makes uwsgi reload, SIGINT makes it exit right away.
+                process.send_signal(signal.SIGINT)
+                process.wait()
@@ -0,0 +1,47 @@
+"""
+Measure how long it takes to import the HTTP apps, as a uwsgi worker does on spawn, with `python -X importtime`.
+
+    python3 -m benchmarks.bench_import_time --modules http_server trust_node_server --runs 5 --top 10
+
+Prints the best total import time of each module over `runs` fresh interpreters, and the slowest imports of the
+last run by cumulative time.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def import_times(module):
+    """Return [(cumulative_us, self_us, name)] of one fresh `import module`."""
+    # The apps read LOCAL_PORT at import time, and must not connect to anything.
+    env = dict(os.environ, LOCAL_PORT=os.environ.get("LOCAL_PORT", "9000"))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    times = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        times.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modules", nargs="+", default=["http_server", "trust_node_server"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    for module in args.modules:
+        best = None
+        for _ in range(args.runs):
+            times = import_times(module)
+            total = max(cumulative for cumulative, _, _ in times)
+            best = total if best is None else min(best, total)
+        print(f"{module}: {best / 1000:.1f}ms")
+        for cumulative, self_us, name in sorted(times, reverse=True)[:args.top]:
+            print(f"    {cumulative / 1000:8.1f}ms  (self {self_us / 1000:6.1f}ms)  {name.strip()}")
@@ -0,0 +1,86 @@
+"""
+Compare ingest throughput and reader latency of MinerStore with one lock and with striped locks.
+
+    python3 -m benchmarks.bench_miner_shards --writers 4 --readers 2 --blocks 200000
+"""
+import argparse
+import random
+import threading
+import time
+
+from chain_data_fetcher import Block, MinerStore
+
+
+class TimedLock:
+    """A lock that records how long acquirers waited for it."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wait = 0.0
+
+    def acquire(self):
+        start = time.perf_counter()
+        self._lock.acquire()
+        self.wait += time.perf_counter() - start
+
+    def release(self):
+        self._lock.release()
+
+
+def make_batches(block_count, miner_count, batch_size, seed=0):
+    rng = random.Random(seed)
+    batches = []
+    for start in range(0, block_count, batch_size):
+        batches.append([(f"{start + i:064x}",
+                         Block(f"0x{rng.randrange(miner_count):040x}", 2.0, 1600000000 + start + i, start // batch_size))
+                        for i in range(min(batch_size, block_count - start))])
+    return batches
+
+
+def run(shard_count, batches, writers, readers):
+    store = MinerStore(shard_count)
+    for shard in store.shards:
+        shard.lock = TimedLock()
+    done = threading.Event()
+    read_latencies = []
+
+    def write(worker):
+        for batch in batches[worker::writers]:
+            store.add_blocks(batch, lambda block: True, True)
+
+    def read():
+        while not done.is_set():
+            start = time.perf_counter()
+            store.entries()
+            read_latencies.append(time.perf_counter() - start)
+
+    write_threads = [threading.Thread(target=write, args=(i,)) for i in range(writers)]
+    read_threads = [threading.Thread(target=read) for _ in range(readers)]
+    start = time.perf_counter()
+    for t in write_threads + read_threads:
+        t.start()
+    for t in write_threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    for t in read_threads:
+        t.join()
+    block_count = sum(len(batch) for batch in batches)
+    read_latencies.sort()
+    p99 = read_latencies[int(len(read_latencies) * 0.99)] * 1000 if read_latencies else 0
+    lock_wait = sum(shard.lock.wait for shard in store.shards)
+    print(f"shards={shard_count:<3} {block_count / elapsed:>10.0f} blocks/s  lock wait {lock_wait:6.2f}s  "
+          f"reads {len(read_latencies):>5}  read p99 {p99:7.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=200000)
+    parser.add_argument("--miners", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=50, help="blocks per epoch")
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+    batches = make_batches(args.blocks, args.miners, args.batch)
+    for shard_count in args.shards:
+        run(shard_count, batches, args.writers, args.readers)
@@ -0,0 +1,69 @@
+"""
+Compare memory and pickle size of the compact NodeEndpoint with the previous plain-attribute layout.
+
+    python3 -m benchmarks.bench_node_endpoint --count 100000
+"""
+import argparse
+import gc
+import os
+import pickle
+import random
+import time
+import tracemalloc
+
+from utils.node_endpoint import NodeEndpoint
+
+
+class LegacyNodeEndpoint:
+    def __init__(self, node_id, ip, tcp_port, udp_port):
+        self.node_id = node_id
+        self.ip = ip
+        self.tcp_port = tcp_port
+        self.udp_port = udp_port
+
+
+def make_urls(count):
+    rng = random.Random(0)
+    urls = []
+    for _ in range(count):
+        node_id = os.urandom(64).hex()
+        ip = ".".join(str(rng.randrange(1, 255)) for _ in range(4))
+        urls.append(f"cfxnode://{node_id}@{ip}:32323")
+    return urls
+
+
+def measure(name, build, key, urls):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    nodes = {}
+    for url in urls:
+        endpoint = build(url)
+        nodes[key(endpoint)] = endpoint
+    build_time = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    data = pickle.dumps(nodes)
+    dump_time = time.perf_counter() - start
+    start = time.perf_counter()
+    pickle.loads(data)
+    load_time = time.perf_counter() - start
+    print(f"{name:<8} memory {memory / 2**20:8.1f} MiB  pickle {len(data) / 2**20:8.1f} MiB  "
+          f"build {build_time:.2f}s  dump {dump_time:.2f}s  load {load_time:.2f}s")
+
+
+def legacy_from_url(url):
+    node_id = url[10:138]
+    ip, port = url[139:].split(":")
+    return LegacyNodeEndpoint(node_id, ip, port, port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+    urls = make_urls(args.count)
+    # The node maps are keyed like the node service keys them.
+    measure("legacy", legacy_from_url, lambda endpoint: endpoint.node_id, urls)
+    measure("compact", NodeEndpoint.from_url, lambda endpoint: endpoint.raw_id, urls)
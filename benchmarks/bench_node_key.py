@@ -0,0 +1,33 @@
+"""
+Measure private key -> node id derivations per second.
+
+    python3 -m benchmarks.bench_node_key --keys 2000
+"""
+import argparse
+import os
+import time
+
+from utils.node_key import NodeIdCache, derive_node_id
+from utils.utils import encode_hex, priv_to_pub
+
+
+def measure(name, fn, keys):
+    start = time.perf_counter()
+    for key in keys:
+        fn(key)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<16} {len(keys) / elapsed:>12.0f} derivations/sec")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=1000)
+    args = parser.parse_args()
+    keys = [encode_hex(os.urandom(32)) for _ in range(args.keys)]
+    assert all(derive_node_id(k) == encode_hex(priv_to_pub(k)) for k in keys[:10])
+
+    measure("priv_to_pub", lambda k: encode_hex(priv_to_pub(k)), keys)
+    measure("derive_node_id", derive_node_id, keys)
+    cache = NodeIdCache()
+    measure("cache (cold)", cache.get, keys)
+    measure("cache (warm)", cache.get, keys)
@@ -0,0 +1,42 @@
+"""
+Ping many local UDP responders from one socket and report how long the batch takes.
+
+    python3 -m benchmarks.bench_udp_discovery --nodes 500
+"""
+import argparse
+import asyncio
+import time
+
+from utils.udp_discovery import UdpResponder, udp_ping_all
+
+
+class _Endpoint:
+    def __init__(self, node_id, ip, port):
+        self.node_id = node_id
+        self.ip = ip
+        self.tcp_port = port
+        self.udp_port = port
+
+
+async def run(node_count, dead_count, timeout):
+    responders = [await UdpResponder().start() for _ in range(node_count)]
+    nodes = [_Endpoint(r.node_id, r.host, r.port) for r in responders]
+    # Nodes pointing at closed ports never reply.
+    for i in range(dead_count):
+        nodes.append(_Endpoint("%0128x" % i, "127.0.0.1", 1))
+    start = time.time()
+    replied = await udp_ping_all(nodes, timeout=timeout)
+    elapsed = time.time() - start
+    for r in responders:
+        r.close()
+    assert replied == {r.node_id for r in responders}
+    print(f"pinged {len(nodes)} nodes, {len(replied)} replied in {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=200)
+    parser.add_argument("--dead", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=3)
+    args = parser.parse_args()
+    asyncio.run(run(args.nodes, args.dead, args.timeout))
@@ -0,0 +1,126 @@
+"""
+Check that a pivot chain change is undone and re-applied exactly: feed a live ChainDataFetcher a chain, replace its
+latest epochs with a fork, and compare the result with a fetcher that only ever saw the fork.
+
+    python3 -m benchmarks.check_rollback --epochs 200 --fork-depth 20
+
+The fetchers read epochs from an in-memory chain standing in for the node's RPC, and run in a temporary directory.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+
+from chain_data_fetcher import REORG_DEPTH, ChainDataFetcher
+
+
+class FakeRpcClient:
+    """The part of utils.rpc_client.RpcClient used for ingestion, served from `epochs`: epoch -> list of blocks."""
+    def __init__(self, epochs):
+        self.epochs = epochs
+        self.blocks = {}
+        self.set_epochs(epochs)
+
+    def set_epochs(self, epochs):
+        self.epochs = epochs
+        for blocks in epochs.values():
+            for block in blocks:
+                self.blocks[block["blockHash"]] = block
+
+    @staticmethod
+    def EPOCH_NUM(num):
+        return hex(num)
+
+    def get_block_reward_info(self, epoch):
+        return self.epochs.get(int(epoch, 16), [])
+
+    def block_by_hash(self, block_hash):
+        return {"timestamp": hex(self.blocks[block_hash]["timestamp"])}
+
+
+def make_epochs(first, last, rng, tag, miners):
+    epochs = {}
+    for epoch in range(first, last + 1):
+        epochs[epoch] = [{
+            "blockHash": f"0x{tag}{epoch:061x}{i:02x}",
+            "author": rng.choice(miners),
+            "totalReward": hex(rng.randrange(1, 3 * 10**18)),
+            "timestamp": 1600000000 + epoch * 5 + i,
+        } for i in range(rng.randrange(1, 4))]
+    return epochs
+
+
+def live_fetcher(work_dir, rpc_client):
+    os.makedirs(work_dir)
+    os.chdir(work_dir)
+    fetcher = ChainDataFetcher()
+    fetcher.rpc_client = rpc_client
+    fetcher.block_writer.start()
+    # As after catch-up: from here on, epochs are logged and can be rolled back.
+    fetcher.activated = True
+    return fetcher
+
+
+async def feed(fetcher, epochs):
+    for epoch, blocks in sorted(epochs.items()):
+        await fetcher.handle_new_epoch(epoch, [block["blockHash"] for block in blocks])
+
+
+def same_miners(a, b):
+    """Rewards are float sums, and undoing a block can leave a last-bit rounding difference."""
+    return len(a) == len(b) and all(
+        {**x, "mining_reward": 0} == {**y, "mining_reward": 0} and math.isclose(x["mining_reward"], y["mining_reward"])
+        for x, y in zip(a, b))
+
+
+def state(fetcher, block_hashes):
+    fetcher.block_writer.flush()
+    miners = sorted(json.loads(fetcher.miner_list()), key=lambda entry: entry["address"])
+    known = {block_hash for block_hash in block_hashes if block_hash in fetcher.known_blocks}
+    return miners, set(fetcher.blocks_db.keys()), known, fetcher.block_writer.watermark
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--fork-depth", type=int, default=20)
+    parser.add_argument("--miners", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if not 0 < args.fork_depth <= REORG_DEPTH:
+        raise SystemExit(f"--fork-depth must be in (0, {REORG_DEPTH}]")
+
+    rng = random.Random(args.seed)
+    miners = [f"0x{rng.getrandbits(160):040x}" for _ in range(args.miners)]
+    fork_epoch = args.epochs - args.fork_depth + 1
+    chain = make_epochs(1, args.epochs, rng, "a", miners)
+    fork = dict(chain)
+    fork.update(make_epochs(fork_epoch, args.epochs, rng, "b", miners))
+    block_hashes = [block["blockHash"] for blocks in list(chain.values()) + list(fork.values()) for block in blocks]
+    work_dir = tempfile.mkdtemp(prefix="check_rollback_")
+
+    reorged_rpc = FakeRpcClient(chain)
+    reorged = live_fetcher(os.path.join(work_dir, "reorged"), reorged_rpc)
+    asyncio.run(feed(reorged, chain))
+    before = state(reorged, block_hashes)
+    reorged_rpc.set_epochs(fork)
+    asyncio.run(feed(reorged, {epoch: fork[epoch] for epoch in range(fork_epoch, args.epochs + 1)}))
+
+    expected = live_fetcher(os.path.join(work_dir, "expected"), FakeRpcClient(fork))
+    asyncio.run(feed(expected, fork))
+
+    after, want = state(reorged, block_hashes), state(expected, block_hashes)
+    checks = {
+        "fork changed the miners": not same_miners(before[0], after[0]),
+        "miner list matches the fork": same_miners(after[0], want[0]),
+        "blocks_db matches the fork": after[1] == want[1],
+        "known blocks match the fork": after[2] == want[2],
+        "watermark matches the fork": after[3] == want[3],
+    }
+    for name, ok in checks.items():
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    sys.exit(0 if all(checks.values()) else 1)
@@ -0,0 +1,57 @@
+"""
+Deterministic generator of synthetic block streams for the benchmarks.
+
+Miners are Zipf-distributed, so a few miners produce most blocks and most miners produce few. Block timestamps follow
+a fixed block interval with per-miner clock skew and per-block noise, so a miner's blocks are not timestamp ordered.
+Epochs arrive shuffled within windows of `disorder` epochs, like the parallel catch-up applies them.
+"""
+import itertools
+import random
+
+from chain_data_fetcher import Block
+
+
+class SyntheticChain:
+    def __init__(self, miners=10000, blocks=10000000, blocks_per_epoch=5, skew=1.1, block_interval=0.5,
+                 clock_skew=30, disorder=64, start_timestamp=1600000000, seed=0):
+        self.miners = miners
+        self.blocks = blocks
+        self.blocks_per_epoch = blocks_per_epoch
+        self.skew = skew
+        self.block_interval = block_interval
+        self.clock_skew = clock_skew
+        self.disorder = max(1, disorder)
+        self.start_timestamp = start_timestamp
+        self.seed = seed
+        rng = random.Random(seed)
+        # Sorted by rank: addresses[0] mines the most blocks.
+        self.addresses = [f"0x{rng.getrandbits(160):040x}" for _ in range(miners)]
+        self._cum_weights = list(itertools.accumulate(1 / (rank + 1) ** skew for rank in range(miners)))
+        self._clock_offsets = {address: int(rng.gauss(0, clock_skew)) for address in self.addresses}
+
+    @property
+    def epoch_count(self):
+        return (self.blocks + self.blocks_per_epoch - 1) // self.blocks_per_epoch
+
+    def epochs(self):
+        """Yield (epoch, {block_hash: Block}) for every epoch, the same sequence for the same parameters."""
+        rng = random.Random(self.seed + 1)
+        window = []
+        produced = 0
+        for epoch in range(1, self.epoch_count + 1):
+            count = min(self.blocks_per_epoch, self.blocks - produced)
+            authors = rng.choices(self.addresses, cum_weights=self._cum_weights, k=count)
+            base_timestamp = self.start_timestamp + produced * self.block_interval
+            blocks = {}
+            for i, author in enumerate(authors):
+                timestamp = int(base_timestamp + i * self.block_interval + self._clock_offsets[author]
+                                + rng.uniform(-2, 2))
+                blocks[f"0x{rng.getrandbits(256):064x}"] = Block(author, 2.0, timestamp, epoch)
+            produced += count
+            window.append((epoch, blocks))
+            if len(window) == self.disorder:
+                rng.shuffle(window)
+                yield from window
+                window = []
+        rng.shuffle(window)
+        yield from window
@@ -1,5 +1,7 @@
+import collections
 import json
 import logging
+import socketserver
 import subprocess
 import threading
 import asyncio
@@ -11,18 +13,40 @@ import os
 import sqlitedict
 from concurrent.futures.thread import ThreadPoolExecutor
 
+from utils import rpc_cache
+from utils.async_http import AsyncHttpServer, HttpError, StreamResponse
+from utils.block_hash_index import BlockHashIndex
+from utils.broadcaster import Broadcaster
+from utils.common import http_rpc_url, parse_date, pubsub_url, setup_log, sse_event
+from utils.mmap_snapshot import remove_snapshot, touch_snapshot, write_snapshot
 from utils.pubsub import PubSubClient
 from utils.rpc_client import RpcClient
 from utils.simple_proxy import SimpleRpcProxy
-from utils.utils import http_rpc_url, pubsub_url, setup_log, parse_date
+from utils.single_flight import SingleFlight
+from utils.write_behind import WriteBehind
 from xmlrpc.server import SimpleXMLRPCServer
 
 MAX_ACTIVE_PERIOD = 3600 * 4  # 2h
 TIMESTAMP_HIST_COUNT = 2000
+HIST_CACHE_TTL_SECONDS = 5
+SNAPSHOT_INTERVAL_SECONDS = 5
+UPDATE_TICK_SECONDS = 1
+# Most open /miner-updates streams, beyond which new ones get 503
+MAX_UPDATE_STREAMS = 1000
+# Idle seconds after which a comment line is sent on miner update streams
+KEEPALIVE_SECONDS = 15
+# Number of latest epochs that can be rolled back when the pivot chain changes
+REORG_DEPTH = 100
+# How often the rpc cache learns the chain's latest confirmed epoch
+FINALIZED_EPOCH_REFRESH_SECONDS = 60
+MINER_SHARD_COUNT = 16
 MAX_TIMESTAMP = 1 << 63
+DEFAULT_CAMPAIGN = "default"
 
 logger = logging.getLogger("fetcher")
 LATEST_EPOCH_KEY = "latest_epoch"
+# Ranges of the epochs committed above LATEST_EPOCH_KEY
+DONE_EPOCHS_KEY = "done_epochs"
 
 
 class Block:
@@ -38,13 +62,17 @@ class Block:
 
 
 class Miner:
-    def __init__(self, addr, activated):
+    def __init__(self, addr, activated, track_all=True):
         # TODO Use byte representation instead of hex string.
         self.addr = addr
         self.reward = 0
         self.timestamps = []
         self.all_timestamps = []
+        # Whether `all_timestamps` also records the blocks outside of the range.
+        self.track_all = track_all
         self.latest_mined_block = 0
+        # Bumped whenever a block is added or removed
+        self.changes = 0
         # This is None when we have not recovered all the blocks before we start.
         # It is initialized after we recovered those old blocks, and we assume we will not receive a new block
         # to "activate" a period when the node is inactive.
@@ -55,8 +83,13 @@ class Miner:
         # logger.debug(f"add miner, addr={addr} activated={activated}")
 
     def add_block(self, block: Block, within_range: bool):
+        """Add `block` and return what `remove_block` needs to undo it."""
         assert self.addr == block.miner
-        bisect.insort(self.all_timestamps, block.timestamp)
+        prev_latest_mined_block = self.latest_mined_block
+        active_period_added = 0
+        self.changes += 1
+        if self.track_all:
+            bisect.insort(self.all_timestamps, block.timestamp)
         if within_range:
             self.reward += block.reward
             if self.latest_mined_block < block.get_timestamp():
@@ -65,8 +98,24 @@ class Miner:
                 gap = block.timestamp - self.timestamps[-1]
                 if self.active_period is not None and 0 < gap <= MAX_ACTIVE_PERIOD:
                     self.active_period += gap
+                    active_period_added = gap
             bisect.insort(self.timestamps, block.timestamp)
             logger.debug(f"add block, miner={block.miner} active_period={self.active_period}")
+        return prev_latest_mined_block, active_period_added
+
+    def remove_block(self, block: Block, within_range: bool, undo):
+        """Undo `add_block`. Blocks must be removed in the reverse order they were added."""
+        prev_latest_mined_block, active_period_added = undo
+        self.changes += 1
+        if self.track_all:
+            del self.all_timestamps[bisect.bisect_left(self.all_timestamps, block.timestamp)]
+        if within_range:
+            self.reward -= block.reward
+            self.latest_mined_block = prev_latest_mined_block
+            if active_period_added != 0:
+                self.active_period -= active_period_added
+            del self.timestamps[bisect.bisect_left(self.timestamps, block.timestamp)]
+            logger.debug(f"remove block, miner={block.miner} active_period={self.active_period}")
 
     def activate(self):
         logger.debug(f"activate {self.addr}")
@@ -84,36 +133,281 @@ class Miner:
         logger.debug(f"end activate {self.addr}")
 
 
+def timestamp_histogram(timestamps):
+    """Return the accumulative histogram of the sorted, non-empty `timestamps` in TIMESTAMP_HIST_COUNT buckets."""
+    # TODO This can be optimized if it's too slow.
+    min_timestamp = timestamps[0]
+    max_timestamp = timestamps[-1]
+    hist = [0 for _ in range(TIMESTAMP_HIST_COUNT)]
+    period = (max_timestamp - min_timestamp) / TIMESTAMP_HIST_COUNT
+    if period != 0:
+        for ts in timestamps:
+            index = int((ts - min_timestamp) / period)
+            if index < TIMESTAMP_HIST_COUNT:
+                hist[index] += 1
+            else:
+                hist[-1] += 1
+    for i in range(TIMESTAMP_HIST_COUNT - 1):
+        hist[i + 1] += hist[i]
+    return json.dumps({
+        "min_timestamp": min_timestamp,
+        "max_timestamp": max_timestamp,
+        "accumulative_count": hist,
+    })
+
+
+class EpochRecord:
+    """The blocks of one applied epoch, with what is needed to undo them."""
+    def __init__(self, epoch, block_hashes):
+        self.epoch = epoch
+        self.block_hashes = block_hashes
+        # Map from campaign name to the list of (block_hash, block, within_range, undo) in the order they were
+        # applied to that campaign
+        self.applied = {}
+
+
+def miner_entry(miner_addr, miner):
+    active_period = 0
+    if miner is None or len(miner.timestamps) == 0:
+        return None
+    if miner.active_period is not None:
+        active_period = miner.active_period
+    return {
+        "address": miner_addr,
+        "block_count": len(miner.timestamps),
+        "active_period": int(active_period/3600),
+        "mining_reward": miner.reward,
+        "latest_mined_block": miner.latest_mined_block,
+    }
+
+
+class MinerShard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.miners = {}
+        # Addresses of the miners changed since the last update tick
+        self.dirty = set()
+        # Bumped on every change, used to key cached results
+        self.version = 0
+
+
+class MinerStore:
+    """
+    Miner state partitioned into shards by address hash, each with its own lock, so that ingest workers touching
+    different miners do not wait for each other. Whole-list reads combine per-shard snapshots.
+    """
+    def __init__(self, shard_count=MINER_SHARD_COUNT, track_all=True):
+        self.shards = [MinerShard() for _ in range(shard_count)]
+        # If False, only blocks within the range are kept.
+        self.track_all = track_all
+
+    def shard_of(self, miner_addr):
+        return self.shards[hash(miner_addr) % len(self.shards)]
+
+    def add_blocks(self, blocks, in_range, activated):
+        """
+        Add `blocks`, a list of (block_hash, block), and return the list of (block_hash, block, within_range, undo)
+        in the order they were applied.
+        """
+        by_shard = {}
+        for block_hash, block in blocks:
+            by_shard.setdefault(hash(block.miner) % len(self.shards), []).append((block_hash, block))
+        applied = []
+        for shard_index, shard_blocks in by_shard.items():
+            shard = self.shards[shard_index]
+            shard.lock.acquire()
+            for block_hash, block in shard_blocks:
+                within_range = in_range(block)
+                if not within_range and not self.track_all:
+                    continue
+                undo = shard.miners\
+                    .setdefault(block.miner, Miner(block.miner, activated, self.track_all))\
+                    .add_block(block, within_range)
+                applied.append((block_hash, block, within_range, undo))
+                if within_range:
+                    shard.dirty.add(block.miner)
+            shard.version += 1
+            shard.lock.release()
+        return applied
+
+    def remove_blocks(self, applied):
+        for block_hash, block, within_range, undo in reversed(applied):
+            shard = self.shard_of(block.miner)
+            shard.lock.acquire()
+            miner = shard.miners[block.miner]
+            miner.remove_block(block, within_range, undo)
+            shard.dirty.add(block.miner)
+            if len(miner.all_timestamps) == 0 and len(miner.timestamps) == 0:
+                del shard.miners[block.miner]
+            shard.version += 1
+            shard.lock.release()
+
+    def activate_all(self):
+        for shard in self.shards:
+            shard.lock.acquire()
+            for miner in shard.miners.values():
+                miner.activate()
+            shard.dirty.update(shard.miners)
+            shard.version += 1
+            shard.lock.release()
+
+    def entries(self):
+        miner_list = []
+        for shard in self.shards:
+            shard.lock.acquire()
+            for miner_addr, miner in shard.miners.items():
+                entry = miner_entry(miner_addr, miner)
+                if entry is not None:
+                    miner_list.append(entry)
+            shard.lock.release()
+        return miner_list
+
+    def take_dirty_entries(self):
+        """Return the entries of the miners changed since the last call, keyed by address."""
+        deltas = {}
+        for shard in self.shards:
+            shard.lock.acquire()
+            for miner_addr in shard.dirty:
+                entry = miner_entry(miner_addr, shard.miners.get(miner_addr))
+                if entry is None:
+                    # The miner's blocks were rolled back or are out of range.
+                    entry = {"address": miner_addr, "removed": True}
+                deltas[miner_addr] = entry
+            shard.dirty.clear()
+            shard.lock.release()
+        return deltas
+
+    def __len__(self):
+        return sum(len(shard.miners) for shard in self.shards)
+
+
+class Campaign:
+    """
+    A named reward window. Blocks count for a campaign if they are in an epoch >= `initial_epoch` and their
+    timestamp is in `[start_timestamp, end_timestamp]`.
+    """
+    def __init__(self, name, initial_epoch=0, start_timestamp=0, end_timestamp=MAX_TIMESTAMP, track_all=False):
+        self.name = name
+        self.initial_epoch = initial_epoch
+        self.start_timestamp = start_timestamp
+        self.end_timestamp = end_timestamp
+        self.miners = MinerStore(track_all=track_all)
+
+    @classmethod
+    def from_config(cls, config):
+        """Timestamps can also be given as dates in the `parse_date` format, e.g. "00:00-25/08/2020"."""
+        def timestamp(value, default):
+            if value is None:
+                return default
+            return parse_date(value) if isinstance(value, str) else value
+        return cls(config["name"], config.get("initial_epoch", 0),
+                   timestamp(config.get("start_timestamp"), 0), timestamp(config.get("end_timestamp"), MAX_TIMESTAMP))
+
+    def in_range(self, block):
+        return block.epoch >= self.initial_epoch and self.start_timestamp <= block.timestamp <= self.end_timestamp
+
+
 class ChainDataFetcher(threading.Thread):
     def __init__(self, server_ip="127.0.0.1", http_port=12537, pubsub_port=12535, initial_epoch=0, start_timestamp=0,
-                 end_timestamp=MAX_TIMESTAMP):
+                 end_timestamp=MAX_TIMESTAMP, rpc_cache_dir=None, rpc_cache_mode=rpc_cache.PASSTHROUGH, campaigns=(),
+                 snapshot_path=None, live_epochs=False):
         super().__init__(daemon=True)
-        self.rpc_client = RpcClient(SimpleRpcProxy(http_rpc_url(server_ip, http_port), timeout=3600))
+        if rpc_cache_dir is not None:
+            self.rpc_cache = rpc_cache.RpcCache(rpc_cache_dir, rpc_cache_mode)
+        else:
+            self.rpc_cache = None
+        self.rpc_client = RpcClient(SimpleRpcProxy(http_rpc_url(server_ip, http_port), timeout=3600,
+                                                   cache=self.rpc_cache))
         self.pubsub_client = PubSubClient(pubsub_url(server_ip, pubsub_port))
-        self.blocks_db = sqlitedict.SqliteDict("data.db", tablename="blocks", autocommit=True)
-        self.metadata_db = sqlitedict.SqliteDict("data.db", tablename="metadata", autocommit=True)
-
-        self.miners = {}
+        self.blocks_db = sqlitedict.SqliteDict("data.db", tablename="blocks", autocommit=False)
+        self.metadata_db = sqlitedict.SqliteDict("data.db", tablename="metadata", autocommit=False)
+        # Commits the writes to both dbs in groups. Its watermark is saved as LATEST_EPOCH_KEY once all the epochs up
+        # to it are committed, and the epochs committed above it as DONE_EPOCHS_KEY. Catch-up restarts from the
+        # watermark and skips those.
+        self.block_writer = WriteBehind(self.metadata_db, LATEST_EPOCH_KEY,
+                                        max(1, self.metadata_db.get(LATEST_EPOCH_KEY, initial_epoch)) - 1,
+                                        done_key=DONE_EPOCHS_KEY)
+        # Hashes of the blocks in `blocks_db` that are applied to the miners, so that ingestion never queries sqlite
+        # to skip known blocks.
+        self.known_blocks = BlockHashIndex()
+
+        # The default campaign keeps every block, so it also backs the epoch undo log and the update stream. Its epoch
+        # range is unbounded: `initial_epoch` only filters the blocks recovered from `blocks_db`.
+        default_campaign = Campaign(DEFAULT_CAMPAIGN, 0, start_timestamp, end_timestamp, track_all=True)
+        self.campaigns = {DEFAULT_CAMPAIGN: default_campaign}
+        for campaign in campaigns:
+            # Replacing the default campaign would leave `self.miners` on a store that nothing updates.
+            if campaign.name in self.campaigns:
+                raise ValueError(f"campaign name {campaign.name!r} is reserved or used twice")
+            self.campaigns[campaign.name] = campaign
+        self.miners = default_campaign.miners
 
         self.initial_epoch = initial_epoch
-        self.end_timestamp = end_timestamp
-        self.start_timestamp = start_timestamp
+        # If set, catch up to the node's latest epoch and then follow new epochs, undoing pivot chain changes.
+        # Otherwise, ingest up to a fixed epoch.
+        self.live_epochs = live_epochs
         self.activated = False
         self._lock = threading.Lock()
+        # Coalesces identical histogram requests, keyed by (campaign, miner, shard version).
+        self._hist_flight = SingleFlight(ttl=HIST_CACHE_TTL_SECONDS)
+
+        # Miner changes are published as one delta event per tick to the open /miner-updates streams.
+        # `update_version` is the version of the latest tick.
+        self.update_version = 0
+        self.update_streams = Broadcaster(max_subscribers=MAX_UPDATE_STREAMS)
+        # Shares the snapshot event of one version among the streams opened at that version.
+        self._snapshot_event_flight = SingleFlight(ttl=UPDATE_TICK_SECONDS, max_size=4)
+
+        # EpochRecords of the epochs applied after activation, in application order, for the latest REORG_DEPTH
+        # epochs. This is the epoch -> block hashes index used to detect and undo pivot chain changes.
+        self.epoch_log = collections.deque()
+
+        # If set, the miner lists of http_server.py are published there for its workers to read without RPC, once
+        # catch-up is over.
+        self.snapshot_path = snapshot_path
+        self._snapshot_generation = 0
 
     def run(self) -> None:
         last_epoch = self.recover()
+        self.block_writer.start()
+        if self.snapshot_path is not None:
+            # A snapshot left by an earlier run is stale until this one is activated.
+            remove_snapshot(self.snapshot_path)
+            threading.Thread(target=self.snapshot_loop, daemon=True).start()
         asyncio.run(self.start_async(last_epoch))
 
     async def start_async(self, last_epoch):
         log_fut = asyncio.create_task(self.log_progress())
-        # subscription = await self.pubsub_client.subscribe("epochs")
-        # sub_fut = asyncio.create_task(self.sub(subscription))
-        # end_epoch_number = self.rpc_client.epoch_number()
-        end_epoch_number = 345000
+        tick_fut = asyncio.create_task(self.publish_updates())
+        futs = [log_fut, tick_fut]
+        if self.live_epochs:
+            # Subscribed before reading the latest epoch, so that no epoch falls between catch-up and the stream.
+            subscription = await self.pubsub_client.subscribe("epochs")
+            futs.append(asyncio.create_task(self.sub(subscription)))
+            end_epoch_number = self.rpc_client.epoch_number()
+        else:
+            end_epoch_number = 345000
+        if self.rpc_cache is not None:
+            # Set before catching up, so that its results are cached.
+            self.refresh_finalized_epoch()
+            futs.append(asyncio.create_task(self.track_finalized_epoch()))
         catch_up_fut = asyncio.create_task(self.catch_up(last_epoch, end_epoch_number))
-        # await asyncio.gather(sub_fut, catch_up_fut, log_fut)
-        await asyncio.gather(catch_up_fut, log_fut)
+        await asyncio.gather(catch_up_fut, *futs)
+
+    def refresh_finalized_epoch(self):
+        """Only cache results up to the chain's latest confirmed epoch, which will not be reorganized."""
+        try:
+            epoch = self.rpc_client.epoch_number(self.rpc_client.EPOCH_LATEST_CONFIRMED)
+        except Exception as e:
+            logger.warning(f"cannot get the latest confirmed epoch: {e}")
+            return
+        # Never lower it, even if a node that is behind answers.
+        self.rpc_cache.finalized_epoch = max(self.rpc_cache.finalized_epoch, epoch)
+
+    async def track_finalized_epoch(self):
+        while True:
+            await asyncio.sleep(FINALIZED_EPOCH_REFRESH_SECONDS)
+            self.refresh_finalized_epoch()
 
     async def sub(self, subscription):
         while True:
@@ -121,20 +415,11 @@ class ChainDataFetcher(threading.Thread):
                 async for new_epoch_data in subscription.iter(3600):
                     epoch_number = int(new_epoch_data["epochNumber"], 16)
                     logger.debug(f"pubsub get epoch number {epoch_number}")
-                    # epoch_hashes = new_epoch_data["epochHashesOrdered"]
-                    # for new_hash in epoch_hashes:
-                    #     if new_hash not in self.blocks:
-                    #         new_block = self.rpc_client.block_by_hash(new_hash)
-                    #         miner = new_block["author"]
-                    #         timestamp = new_block["timestamp"]
-                    #         self.blocks[new_hash] = Block(new_hash, miner, timestamp)
-                    #         self.miners.setdefault(miner, set()).add(new_hash)
-                    await self.update_epoch_number(epoch_number, catch_up=False)
+                    await self.handle_new_epoch(epoch_number, new_epoch_data["epochHashesOrdered"])
             except Exception as e:
+                # The pub-sub client reconnects and resubscribes by itself.
                 logger.warning(e)
                 traceback.print_exc()
-                self.pubsub_client.ws = None
-                subscription = await self.pubsub_client.subscribe("epochs")
 
     async def update_epoch_number(self, epoch_number, catch_up):
         logger.debug(f"update_epoch_number: epoch_number={epoch_number}, catch_up={catch_up}")
@@ -146,23 +431,90 @@ class ChainDataFetcher(threading.Thread):
                 logger.debug(f"{epoch_number} not executed, wait for 1 second")
                 await asyncio.sleep(1)
         blocks = {}
+        block_hashes = []
         for reward_info in rewards:
             block_hash = reward_info["blockHash"]
             author = reward_info["author"]
             reward = int(reward_info["totalReward"], 16) / 10**18
-            if block_hash not in self.blocks_db:
+            block_hashes.append(block_hash)
+            if block_hash not in self.known_blocks:
                 timestamp = int(self.rpc_client.block_by_hash(block_hash)["timestamp"], 16)
                 blocks[block_hash] = Block(author, reward, timestamp, epoch_number)
+        self.apply_blocks(epoch_number, block_hashes, blocks)
+        self.block_writer.update(self.blocks_db, blocks.items())
+        self.known_blocks.update(blocks)
+        self.block_writer.done(epoch_number)
+        logger.debug(f"update_epoch_number end: epoch_number={epoch_number}")
+
+    def apply_blocks(self, epoch_number, block_hashes, blocks):
+        activated = self.activated
+        record = EpochRecord(epoch_number, block_hashes)
+        for name, campaign in self.campaigns.items():
+            record.applied[name] = campaign.miners.add_blocks(blocks.items(), campaign.in_range, activated)
+        # Catch-up epochs are final, and `activate` recomputes active periods anyway.
+        if activated:
+            self._lock.acquire()
+            self.epoch_log.append(record)
+            while self.epoch_log[0].epoch <= epoch_number - REORG_DEPTH:
+                self.epoch_log.popleft()
+            self._lock.release()
+
+    def recorded_epoch_hashes(self, epoch_number):
         self._lock.acquire()
-        for block_hash, block in blocks.items():
-            self.miners\
-                .setdefault(block.miner, Miner(block.miner, self.activated))\
-                .add_block(block, self.start_timestamp <= block.timestamp <= self.end_timestamp)
+        hashes = None
+        for record in self.epoch_log:
+            if record.epoch == epoch_number:
+                hashes = record.block_hashes
         self._lock.release()
-        self.blocks_db.update(blocks)
-        if catch_up or self.activated:
-            self.metadata_db[LATEST_EPOCH_KEY] = epoch_number
-        logger.debug(f"update_epoch_number end: epoch_number={epoch_number}")
+        return hashes
+
+    async def handle_new_epoch(self, epoch_number, epoch_hashes):
+        recorded = self.recorded_epoch_hashes(epoch_number)
+        if recorded is not None:
+            if set(recorded) == set(epoch_hashes):
+                return
+            logger.info(f"pivot chain changed at epoch {epoch_number}")
+            self.rollback(epoch_number)
+        await self.update_epoch_number(epoch_number, catch_up=False)
+
+    def rollback(self, from_epoch):
+        """
+        Undo all epochs >= `from_epoch` in O(blocks applied since then). Epochs before `from_epoch` that were applied
+        after it are undone too, to keep the undo order exact, and then applied again.
+        """
+        self._lock.acquire()
+        first = None
+        for i, record in enumerate(self.epoch_log):
+            if record.epoch >= from_epoch:
+                first = i
+                break
+        if first is None:
+            self._lock.release()
+            logger.warning(f"cannot roll back to epoch {from_epoch}, it is not in the latest {REORG_DEPTH} epochs")
+            return
+        popped = []
+        while len(self.epoch_log) > first:
+            popped.append(self.epoch_log.pop())
+        self._lock.release()
+        # Epochs are applied one at a time after activation, so nothing is applied concurrently with this.
+        kept = []
+        removed_hashes = []
+        for record in popped:
+            for name, applied in record.applied.items():
+                self.campaigns[name].miners.remove_blocks(applied)
+            all_applied = record.applied[DEFAULT_CAMPAIGN]
+            if record.epoch >= from_epoch:
+                removed_hashes.extend(block_hash for block_hash, _, _, _ in all_applied)
+            else:
+                kept.append(record)
+        for record in reversed(kept):
+            self.apply_blocks(record.epoch, record.block_hashes,
+                              {block_hash: block for block_hash, block, _, _ in record.applied[DEFAULT_CAMPAIGN]})
+        for block_hash in removed_hashes:
+            self.block_writer.delete(self.blocks_db, block_hash)
+            self.known_blocks.discard(block_hash)
+        self.block_writer.reset(from_epoch - 1)
+        logger.info(f"rolled back {len(removed_hashes)} blocks from epoch {from_epoch}")
 
     async def catch_up(self, start_epoch_number: int, end_epoch_number: int):
         start_epoch_number = max(1, start_epoch_number)
@@ -170,13 +522,15 @@ class ChainDataFetcher(threading.Thread):
         futures = []
         executor = ThreadPoolExecutor(max_workers=4)
         for epoch_number in range(start_epoch_number, end_epoch_number+1):
+            if self.block_writer.is_done(epoch_number):
+                continue
             futures.append(executor.submit(lambda e: asyncio.run(self.update_epoch_number(e, catch_up=True)),
                                            epoch_number))
         for f in futures:
             f.result()
+        for campaign in self.campaigns.values():
+            campaign.miners.activate_all()
         self._lock.acquire()
-        for miner_addr in self.miners:
-            self.miners[miner_addr].activate()
         self.activated = True
         self._lock.release()
         logger.info(f"catch_up ends: self.activated={self.activated}")
@@ -186,72 +540,132 @@ class ChainDataFetcher(threading.Thread):
             logger.info(f"progress: {self.progress_string()}")
             await asyncio.sleep(1)
 
+    async def publish_updates(self):
+        while True:
+            self.tick_updates()
+            await asyncio.sleep(UPDATE_TICK_SECONDS)
+
+    def tick_updates(self):
+        deltas = self.miners.take_dirty_entries()
+        if len(deltas) != 0:
+            self._lock.acquire()
+            self.update_version += 1
+            version = self.update_version
+            self._lock.release()
+            if len(self.update_streams) != 0:
+                self.update_streams.publish(version, sse_event("delta", list(deltas.values())))
+
+    def miner_snapshot_event(self):
+        """Return `(version, event)`: the `snapshot` event of the full miner list as of update `version`."""
+        # Read the version first: changes made meanwhile are also sent as deltas, which is harmless.
+        self._lock.acquire()
+        version = self.update_version
+        self._lock.release()
+        return self._snapshot_event_flight.do(version, lambda: (version, sse_event("snapshot", self.miners.entries())))
+
     def progress_string(self):
         self._lock.acquire()
-        r = f"block_count: {len(self.blocks_db)}"
+        r = f"block_count: {len(self.known_blocks)}"
         self._lock.release()
+        if self.block_writer.error is not None:
+            r += f", block writes failing: {self.block_writer.error}"
         return r
 
     def recover(self):
         if LATEST_EPOCH_KEY in self.metadata_db:
             last_epoch = self.metadata_db[LATEST_EPOCH_KEY]
-            for block in self.blocks_db.values():
-                self._lock.acquire()
-                self.miners\
-                    .setdefault(block.miner, Miner(block.miner, self.activated))\
-                    .add_block(block, block.epoch >= self.initial_epoch and self.start_timestamp <= block.timestamp <= self.end_timestamp)
-                self._lock.release()
+            def in_default_range(block):
+                return block.epoch >= self.initial_epoch and self.campaigns[DEFAULT_CAMPAIGN].in_range(block)
+
+            for block_hash, block in self.blocks_db.items():
+                for name, campaign in self.campaigns.items():
+                    in_range = in_default_range if name == DEFAULT_CAMPAIGN else campaign.in_range
+                    campaign.miners.add_blocks([(block_hash, block)], in_range, self.activated)
+                self.known_blocks.add(block_hash)
             return last_epoch
         else:
             return self.initial_epoch
 
     def miner_list(self):
-        self._lock.acquire()
-        miner_list = []
-        for miner_addr in self.miners:
-            miner = self.miners[miner_addr]
-            active_period = 0
-            if len(miner.timestamps) == 0:
-                continue
-            if miner.active_period is not None:
-                active_period = miner.active_period
-            miner_list.append({
-                "address": miner_addr,
-                "block_count": len(miner.timestamps),
-                "active_period": int(active_period/3600),
-                "mining_reward": miner.reward,
-                "latest_mined_block": miner.latest_mined_block,
-            })
-        self._lock.release()
-        return json.dumps(miner_list)
-
-    def miner_block_timestamps(self, miner):
-        self._lock.acquire()
-        if miner not in self.miners:
-            self._lock.release()
+        return json.dumps(self.miners.entries())
+
+    def campaign_list(self):
+        return json.dumps([{
+            "name": campaign.name,
+            "initial_epoch": campaign.initial_epoch,
+            "start_timestamp": campaign.start_timestamp,
+            "end_timestamp": campaign.end_timestamp,
+        } for campaign in self.campaigns.values()])
+
+    def campaign_miner_list(self, name):
+        if name not in self.campaigns:
+            return json.dumps([])
+        return json.dumps(self.campaigns[name].miners.entries())
+
+    def miner_block_timestamps(self, miner, campaign=None):
+        """
+        Without `campaign`, the histogram covers all the blocks of `miner`; with it, only the blocks within that
+        campaign's window.
+        """
+        if campaign is None:
+            store = self.miners
+        elif campaign in self.campaigns:
+            store = self.campaigns[campaign].miners
+        else:
+            return []
+        shard = store.shard_of(miner)
+        return self._hist_flight.do((campaign, miner, shard.version),
+                                    lambda: self._miner_block_timestamps(shard, miner, campaign))
+
+    def _miner_block_timestamps(self, shard, miner, campaign):
+        shard.lock.acquire()
+        if miner not in shard.miners or (campaign is not None and len(shard.miners[miner].timestamps) == 0):
+            shard.lock.release()
             return []
+        # Copied under the lock, binned after releasing it.
+        if campaign is None:
+            timestamps = list(shard.miners[miner].all_timestamps)
         else:
-            timestamps = self.miners[miner].all_timestamps
-            # TODO This can be optimized if it's too slow.
-            min_timestamp = timestamps[0]
-            max_timestamp = timestamps[-1]
-            hist = [0 for _ in range(TIMESTAMP_HIST_COUNT)]
-            period = (max_timestamp - min_timestamp) / TIMESTAMP_HIST_COUNT
-            if period != 0:
-                for ts in timestamps:
-                    index = int((ts - min_timestamp) / period)
-                    if index < TIMESTAMP_HIST_COUNT:
-                        hist[index] += 1
-                    else:
-                        hist[-1] += 1
-            for i in range(TIMESTAMP_HIST_COUNT - 1):
-                hist[i + 1] += hist[i]
-        self._lock.release()
-        return json.dumps({
-            "min_timestamp": min_timestamp,
-            "max_timestamp": max_timestamp,
-            "accumulative_count": hist,
-        })
+            timestamps = list(shard.miners[miner].timestamps)
+        shard.lock.release()
+        return timestamp_histogram(timestamps)
+
+    def snapshot_blobs(self):
+        """
+        Return the response bodies of http_server.py keyed as it looks them up in the snapshot. The default campaign
+        is only published under the keys without a campaign prefix. Timestamp histograms are not published: they are
+        built on demand over RPC.
+        """
+        # The entries are copied under the shard locks and serialized after releasing them.
+        blobs = {
+            "miner_list": self.miner_list().encode(),
+            "campaigns": self.campaign_list().encode(),
+        }
+        for name in self.campaigns:
+            if name != DEFAULT_CAMPAIGN:
+                blobs[f"campaign/{name}/miner_list"] = self.campaign_miner_list(name).encode()
+        return blobs
+
+    def snapshot_loop(self):
+        """
+        Once activated, publish a new snapshot to `snapshot_path` every SNAPSHOT_INTERVAL_SECONDS if any miner changed,
+        or touch the current one so that readers know it is still current.
+        """
+        published = None
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL_SECONDS)
+            if not self.activated:
+                continue
+            versions = [shard.version for campaign in self.campaigns.values() for shard in campaign.miners.shards]
+            try:
+                if versions == published:
+                    touch_snapshot(self.snapshot_path)
+                    continue
+                self._snapshot_generation += 1
+                write_snapshot(self.snapshot_path, self.snapshot_blobs(), self._snapshot_generation)
+                published = versions
+            except Exception as e:
+                logger.warning(f"publish snapshot failed: {e}")
 
 
 def miner_list():
@@ -262,19 +676,121 @@ def miner_block_timestamps(miner):
     return chain_data_fetcher.miner_block_timestamps(miner)
 
 
+def campaign_list():
+    return chain_data_fetcher.campaign_list()
+
+
+def campaign_miner_list(name):
+    return chain_data_fetcher.campaign_miner_list(name)
+
+
+def campaign_miner_block_timestamps(name, miner):
+    return chain_data_fetcher.miner_block_timestamps(miner, name)
+
+
+def load_campaigns(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return [Campaign.from_config(config) for config in json.load(f)]
+
+
+class ThreadingXMLRPCServer(socketserver.ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def async_http_server(port):
+    """The routes of http_server.py, served straight from `chain_data_fetcher` without uwsgi and XML-RPC."""
+    server = AsyncHttpServer("0.0.0.0", port)
+
+    @server.route('/get-mined-block-timestamps', blocking=True)
+    def get_mined_block_timestamps(request):
+        return {"block_timestamps": chain_data_fetcher.miner_block_timestamps("0x" + request.arg("address", ""))}
+
+    @server.route('/get-miner-list', blocking=True)
+    def get_miner_list(request):
+        return chain_data_fetcher.miner_list()
+
+    @server.route('/campaigns')
+    def campaigns(request):
+        return chain_data_fetcher.campaign_list()
+
+    @server.route('/campaigns/<name>/get-miner-list', blocking=True)
+    def get_campaign_miner_list(request, name):
+        return chain_data_fetcher.campaign_miner_list(name)
+
+    @server.route('/campaigns/<name>/get-mined-block-timestamps', blocking=True)
+    def get_campaign_mined_block_timestamps(request, name):
+        return {"block_timestamps": chain_data_fetcher.miner_block_timestamps("0x" + request.arg("address", ""), name)}
+
+    @server.route('/miner-updates')
+    def miner_updates(request):
+        """
+        Server-sent events: one `snapshot` event with the full miner list, then at most one `delta` event per second
+        with the miners that changed. A new `snapshot` is sent if the client falls too far behind.
+        """
+        streams = chain_data_fetcher.update_streams
+        queue = streams.subscribe()
+        if queue is None:
+            raise HttpError(503, "too many miner update streams")
+
+        async def stream():
+            loop = asyncio.get_event_loop()
+            version = None
+            while True:
+                if version is None:
+                    item = None
+                else:
+                    try:
+                        item = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                        continue
+                if item is None:
+                    # A new stream, or one that fell behind, starts over from a snapshot.
+                    version, event = await loop.run_in_executor(None, chain_data_fetcher.miner_snapshot_event)
+                    yield event
+                elif item[0] > version:
+                    yield item[1]
+        return StreamResponse(stream(), headers={"Cache-Control": "no-cache"},
+                              on_close=lambda: streams.unsubscribe(queue))
+
+    return server
+
+
 def start_rpc_server():
-    server = SimpleXMLRPCServer(('localhost', LOCAL_PORT), logRequests=True)
+    # Threaded so that concurrent HTTP workers are served concurrently and identical queries can be coalesced.
+    server = ThreadingXMLRPCServer(('localhost', LOCAL_PORT), logRequests=True)
     server.register_function(miner_list)
     server.register_function(miner_block_timestamps)
+    server.register_function(campaign_list)
+    server.register_function(campaign_miner_list)
+    server.register_function(campaign_miner_block_timestamps)
     server.serve_forever()
 
 
 if __name__ == "__main__":
     LOCAL_PORT = 9000
     PUBLIC_PORT = 4000
+    ASYNC_PUBLIC_PORT = 4100
     os.environ["LOCAL_PORT"] = str(LOCAL_PORT)
+    os.environ.setdefault("SNAPSHOT_FILE", "miner_snapshot.bin")
+    # uwsgi redirects /miner-updates there, since every open stream would hold a worker thread.
+    os.environ["STREAM_PORT"] = str(ASYNC_PUBLIC_PORT)
     setup_log()
-    chain_data_fetcher = ChainDataFetcher(server_ip="101.132.158.162")
+    chain_data_fetcher = ChainDataFetcher(server_ip="101.132.158.162", rpc_cache_dir=os.getenv("RPC_CACHE_DIR"),
+                                          rpc_cache_mode=os.getenv("RPC_CACHE_MODE", rpc_cache.RECORD),
+                                          campaigns=load_campaigns(os.getenv("CAMPAIGNS_FILE", "campaigns.json")),
+                                          snapshot_path=os.environ["SNAPSHOT_FILE"],
+                                          live_epochs=os.getenv("LIVE_EPOCHS") == "1")
     chain_data_fetcher.start()
-    subprocess.Popen(["uwsgi", "--http", f"0.0.0.0:{PUBLIC_PORT}", "--module", "http_server:app"])
+    # "uwsgi" (default) serves http_server.py with uwsgi on PUBLIC_PORT and the built-in server on ASYNC_PUBLIC_PORT,
+    # which also serves the /miner-updates streams. "async" serves everything from the built-in server on PUBLIC_PORT.
+    http_frontend = os.getenv("HTTP_FRONTEND", "uwsgi")
+    if http_frontend == "async":
+        async_http_server(PUBLIC_PORT).start()
+    else:
+        subprocess.Popen(["uwsgi", "--http", f"0.0.0.0:{PUBLIC_PORT}", "--module", "http_server:app", "--threads", "8",
+                          "--processes", os.getenv("HTTP_PROCESSES", "4")])
+        async_http_server(ASYNC_PUBLIC_PORT).start()
     start_rpc_server()
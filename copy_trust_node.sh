@@ -1,15 +1,4 @@
 #!/bin/bash
-date=`date +"%Y.%m.%d"`
-echo "date is" $date
-db_dir="trusted_nodes/$date"
-mkdir -p $db_dir
-while read line
-do
-  a=($line)
-  user=${a[0]}
-  ip=${a[1]}
-  dir=${a[2]}
-  echo $ip
-  scp -o "StrictHostKeyChecking no" -i /home/ubuntu/.ssh/id_rsa $user@$ip:$dir/net_config/trusted_nodes.json $db_dir/$ip-trusted_nodes.json
-done < host_work_dirs
-python3 count_trusted_node.py
+# Fetch trusted_nodes.json from all hosts in host_work_dirs concurrently. The
+# running node service ingests the changed files as they appear.
+python3 trusted_node_collector.py --hosts host_work_dirs "$@"
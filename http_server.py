@@ -1,27 +1,89 @@
 import logging
-import time
+import threading
 import sys
 import os
-from flask import Flask, request
-from utils.utils import setup_log
+from flask import Flask, Response, redirect, request
+from utils.mmap_snapshot import SnapshotReader
+from utils.single_flight import SingleFlight
+from utils.common import setup_log
 from flask_cors import CORS
+from urllib.parse import urlsplit
 from xmlrpc.client import ServerProxy
 
 setup_log()
 app = Flask(__name__)
 CORS(app)
 LOCAL_PORT = os.getenv('LOCAL_PORT')
-chain_data_fetcher = ServerProxy(f'http://localhost:{LOCAL_PORT}')
+# ServerProxy is not thread-safe, so each worker thread has its own.
+_local = threading.local()
+# Concurrent identical requests in this worker share one call to the fetcher.
+_flight = SingleFlight()
+
+
+# Miner lists published by the fetcher, read without RPC. Keys not in the snapshot are asked over RPC. Timestamp
+# histograms are never published and always asked over RPC.
+snapshot = SnapshotReader(os.environ["SNAPSHOT_FILE"]) if os.getenv("SNAPSHOT_FILE") else None
+
+
+def fetcher():
+    if not hasattr(_local, "proxy"):
+        _local.proxy = ServerProxy(f'http://localhost:{LOCAL_PORT}')
+    return _local.proxy
+
+
+def snapshot_or(key, fallback):
+    blob = snapshot.get(key) if snapshot is not None else None
+    if blob is None:
+        return fallback()
+    return Response(bytes(blob), mimetype="application/json")
 
 
 @app.route('/get-mined-block-timestamps', methods=['GET'])
 def get_mined_block_timestamps():
     addr = request.args.get("address")
     return {
-        "block_timestamps": chain_data_fetcher.miner_block_timestamps("0x"+addr)
+        "block_timestamps": _flight.do(("timestamps", addr), lambda: fetcher().miner_block_timestamps("0x"+addr))
     }
 
 
 @app.route('/get-miner-list', methods=['GET'])
 def get_miner_list():
-    return chain_data_fetcher.miner_list()
+    return snapshot_or("miner_list", lambda: _flight.do(("miner_list",), lambda: fetcher().miner_list()))
+
+
+@app.route('/campaigns', methods=['GET'])
+def campaigns():
+    return snapshot_or("campaigns", lambda: fetcher().campaign_list())
+
+
+@app.route('/campaigns/<name>/get-miner-list', methods=['GET'])
+def get_campaign_miner_list(name):
+    return snapshot_or(f"campaign/{name}/miner_list",
+                       lambda: _flight.do(("miner_list", name), lambda: fetcher().campaign_miner_list(name)))
+
+
+@app.route('/campaigns/<name>/get-mined-block-timestamps', methods=['GET'])
+def get_campaign_mined_block_timestamps(name):
+    addr = request.args.get("address")
+    return {
+        "block_timestamps": _flight.do(("timestamps", addr, name),
+                                       lambda: fetcher().campaign_miner_block_timestamps(name, "0x"+addr))
+    }
+
+
+# Port of the fetcher's built-in server, which serves the /miner-updates streams
+STREAM_PORT = os.getenv("STREAM_PORT")
+
+
+@app.route('/miner-updates', methods=['GET'])
+def miner_updates():
+    """
+    Redirect to the miner update stream of the fetcher's built-in server. Serving it here would hold a worker thread
+    per open stream.
+    """
+    if STREAM_PORT is None:
+        return Response("miner update streams are not served", status=503, mimetype="text/plain")
+    hostname = urlsplit(f"//{request.host}").hostname
+    if ":" in hostname:
+        hostname = f"[{hostname}]"
+    return redirect(f"{request.scheme}://{hostname}:{STREAM_PORT}/miner-updates", code=307)
@@ -0,0 +1,134 @@
+"""
+Join the miner registration sheet with the mining and trusted node data and write one combined report.
+
+    python3 miner_report.py --csv miner.csv --miner-list miner_list.json \
+        --trusted-node-list trusted_node_list.json --trusted-nodes-dir trusted_nodes \
+        --from-date 2020.08.25 --to-date 2020.08.31 --output report.csv
+
+Every data source is optional; the columns of a missing source are left out of the report.
+This replaces count_active_period.py, count_trusted_node.py and new_count_trusted_node.py.
+"""
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.node_key import derive_node_id
+
+
+def _derive_or_none(key):
+    try:
+        return derive_node_id(key)
+    except Exception:
+        return None
+
+
+def load_sheet(path, address_column, key_column):
+    """Load the address and key columns of the registration sheet, skipping its header."""
+    addresses = []
+    keys = []
+    with open(path, "r") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            addr = row[address_column].lower() if len(row) > address_column else ""
+            addresses.append(addr[2:] if addr.startswith("0x") else addr)
+            keys.append(row[key_column].strip() if len(row) > key_column else "")
+    return {"address": addresses, "key": keys}
+
+
+def derive_node_ids(keys, workers):
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_derive_or_none, keys, chunksize=max(1, len(keys) // (workers * 8) + 1)))
+
+
+def load_miner_list(path):
+    # Map from address (without 0x) to (active_period, block_count)
+    miners = {}
+    with open(path, "r") as f:
+        for miner in json.load(f):
+            miners[miner["address"].lower().replace("0x", "", 1)] = (miner["active_period"], miner["block_count"])
+    return miners
+
+
+def load_trusted_seconds(path):
+    with open(path, "r") as f:
+        return {node["pubkey"]: float(node["active_period"]) for node in json.load(f)["data"]}
+
+
+def load_trusted_days(nodes_dir, from_date, to_date):
+    """Count on how many days each node appears in any trusted_nodes.json under `nodes_dir/<date>/`."""
+    days = {}
+    for date_dir in os.listdir(nodes_dir):
+        if (from_date and date_dir < from_date) or (to_date and date_dir > to_date):
+            continue
+        node_ids = set()
+        for root, _, files in os.walk(os.path.join(nodes_dir, date_dir)):
+            for node_file in files:
+                if not node_file.endswith("trusted_nodes.json"):
+                    continue
+                with open(os.path.join(root, node_file), "r") as f:
+                    try:
+                        trusted_nodes = json.load(f)
+                    except Exception:
+                        print(f"json load error: {root}, {node_file}")
+                        continue
+                for node in trusted_nodes["nodes"]:
+                    node_ids.add(node["url"][10:138])
+        for node_id in node_ids:
+            days[node_id] = days.get(node_id, 0) + 1
+    return days
+
+
+def build_report(sheet, node_ids, miners=None, trusted_seconds=None, trusted_days=None):
+    columns = {"address": sheet["address"], "node_id": [node_id or "" for node_id in node_ids]}
+    if miners is not None:
+        # Like count_active_period.py, found miners get active_period + 1 so that 0 means "never mined".
+        joined = [miners.get(addr) for addr in sheet["address"]]
+        columns["active_period"] = [m[0] + 1 if m is not None else 0 for m in joined]
+        columns["mined_blocks"] = [m[1] if m is not None else 0 for m in joined]
+    if trusted_seconds is not None:
+        columns["trusted_seconds"] = [trusted_seconds.get(node_id, 0) for node_id in node_ids]
+    if trusted_days is not None:
+        columns["trusted_days"] = [trusted_days.get(node_id, 0) for node_id in node_ids]
+    return columns
+
+
+def write_report(columns, path):
+    names = list(columns)
+    rows = zip(*(columns[name] for name in names))
+    with open(path, "w", newline="") as f:
+        if path.endswith(".json"):
+            json.dump([dict(zip(names, row)) for row in rows], f)
+        else:
+            writer = csv.writer(f)
+            writer.writerow(names)
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", default="miner.csv")
+    parser.add_argument("--address-column", type=int, default=14)
+    parser.add_argument("--key-column", type=int, default=15)
+    parser.add_argument("--miner-list", help="miner list json dumped from /get-miner-list")
+    parser.add_argument("--trusted-node-list", help="trusted node list json dumped from /trusted-node-list")
+    parser.add_argument("--trusted-nodes-dir", help="directory of collected trusted_nodes.json files by date")
+    parser.add_argument("--from-date", help="first date directory to count, e.g. 2020.08.25")
+    parser.add_argument("--to-date", help="last date directory to count, e.g. 2020.08.31")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="report.csv", help="output file, .csv or .json")
+    args = parser.parse_args()
+
+    sheet = load_sheet(args.csv, args.address_column, args.key_column)
+    node_ids = derive_node_ids(sheet["key"], args.workers)
+    columns = build_report(
+        sheet, node_ids,
+        miners=load_miner_list(args.miner_list) if args.miner_list else None,
+        trusted_seconds=load_trusted_seconds(args.trusted_node_list) if args.trusted_node_list else None,
+        trusted_days=(load_trusted_days(args.trusted_nodes_dir, args.from_date, args.to_date)
+                      if args.trusted_nodes_dir else None),
+    )
+    write_report(columns, args.output)
+    print(f"wrote {len(sheet['address'])} rows to {args.output}")
@@ -1,3 +1,5 @@
+import asyncio
+import hashlib
 import json
 import logging
 import os
@@ -5,43 +7,48 @@ import subprocess
 import threading
 import time
 import traceback
-from xmlrpc.server import SimpleXMLRPCServer
 from concurrent.futures.thread import ThreadPoolExecutor
+from xmlrpc.server import SimpleXMLRPCServer
 
 import schedule
 import sqlitedict
-from flask import request
 
-from utils.utils import encode_hex, priv_to_pub, setup_log
+from utils.async_http import AsyncHttpServer, Response
+from utils.common import setup_log
+from utils.dir_watcher import DirWatcher
+from utils.mmap_snapshot import remove_snapshot, touch_snapshot, write_snapshot
+# Imported into this module so that endpoints pickled in node.db as `__main__.NodeEndpoint` can still be loaded.
+from utils.node_endpoint import NodeEndpoint, raw_node_id
+from utils.node_requests import batch_response, node_id_arg, node_id_or_none, number_arg, parse_batch
+from utils.probe_scheduler import ProbeScheduler
+from utils.timestamp_index import TimestampIndex
+from utils.udp_discovery import udp_ping_all
+from utils.uptime import UptimeHistory
 UPDATE_INTERVAL_HOUR = 1
-
-class NodeEndpoint:
-    def __init__(self, node_id, ip, tcp_port, udp_port):
-        self.node_id = node_id
-        self.ip = ip
-        self.tcp_port = tcp_port
-        self.udp_port = udp_port
-
-    @classmethod
-    def from_url(cls, url: str):
-        node_id = url[10:138]
-        ip_port = url[139:].split(":")
-        ip = ip_port[0]
-        ports = ip_port[1].split("+")
-        if len(ports) == 1:
-            return cls(node_id, ip, ports[0], ports[0])
-        else:
-            return cls(node_id, ip, ports[0], ports[1])
+UDP_CHECK_INTERVAL_MINUTE = 10
+SNAPSHOT_INTERVAL_SECONDS = 5
+# Below the uptime slot of UPDATE_INTERVAL_HOUR, so that even stable nodes are probed in every slot despite dispatch
+# delays, and their uptime streaks have no gaps.
+PROBE_MAX_INTERVAL_SECONDS = UPDATE_INTERVAL_HOUR * 3600 * 5 // 6
+# Derives the node ids of the keys in a /node-status-batch request in parallel.
+key_executor = ThreadPoolExecutor(max_workers=8)
 
 
 def recover():
     global latest_alive_nodes
     if len(alive_node_db) == 0:
+        for node in get_node_set().values():
+            probe_scheduler.add(node)
         return update()
     else:
+        # Nodes that were probed but not alive only set their `probed` bits.
+        for ts, nodes in node_db.items():
+            uptime_history.record_sweep(float(ts), [node.raw_id for node in nodes.values()], [])
         last_ts = min([float(i) for i in alive_node_db.keys()])
         for ts, alive_nodes in alive_node_db.items():
+            alive_ts_index.add(ts)
             ts = float(ts)
+            alive_nodes = by_raw_id(alive_nodes)
             _lock.acquire()
             nodes_map.update(alive_nodes)
             # Count how many days these trusted_nodes have been
@@ -51,50 +58,132 @@ def recover():
                 trusted_nodes_time[node_id] += gap
             last_ts = ts
             latest_alive_nodes = alive_nodes
+            mark_state_changed()
             _lock.release()
+            uptime_history.record_sweep(ts, [], alive_nodes.keys())
+        for node_id, node in latest_alive_nodes.items():
+            last_probe_ts[node_id] = last_ts
+            probe_scheduler.add(node)
+        for node in get_node_set().values():
+            probe_scheduler.add(node)
+        refresh_responses()
         return last_ts
 
 
 def update():
-    global latest_alive_nodes
-    global global_last_ts
+    """
+    Snapshot the current alive set and the nodes probed since the previous update.
+
+    Probing itself is done per node by `probe_scheduler`, which calls `on_probe_result`. The trusted node files are
+    read in full only by `recover`; new ones are fed to `ingest_trusted_node_files` by the directory watcher.
+    """
+    global global_last_ts, probed_since_update
     now = time.time()
-    gap = now - global_last_ts
-    nodes = get_node_set()
-    node_db[now] = nodes
-    alive_nodes = check_node_status(nodes)
-    alive_node_db[now] = alive_nodes
     _lock.acquire()
-    latest_alive_nodes = alive_nodes
-    nodes_map.update(alive_nodes)
-    # Count how many days these trusted_nodes have been
-    for node_id in alive_nodes:
-        trusted_nodes_time.setdefault(node_id, 0)
-        trusted_nodes_time[node_id] += gap
+    alive_nodes = dict(latest_alive_nodes)
+    probed_nodes = probed_since_update
+    probed_since_update = {}
     global_last_ts = now
     _lock.release()
+    # Only the nodes probed since the previous update, which `recover` marks as probed in this slot.
+    node_db[now] = probed_nodes
+    alive_node_db[now] = alive_nodes
+    alive_ts_index.add(now)
+    refresh_responses()
     return now
 
 
+def on_probe_result(node, alive, ts):
+    node_id = node.raw_id
+    _lock.acquire()
+    last_ts = last_probe_ts.get(node_id)
+    last_probe_ts[node_id] = ts
+    probed_since_update[node_id] = node
+    if alive:
+        changed = node_id not in latest_alive_nodes or not same_endpoint(nodes_map.get(node_id), node)
+        latest_alive_nodes[node_id] = node
+        nodes_map[node_id] = node
+        # An alive node is credited the time since its previous probe.
+        if node_id not in trusted_nodes_time:
+            trusted_nodes_time[node_id] = 0
+            changed = True
+        if last_ts is not None and ts > last_ts:
+            trusted_nodes_time[node_id] += ts - last_ts
+            changed = True
+    else:
+        changed = latest_alive_nodes.pop(node_id, None) is not None
+    if changed:
+        mark_state_changed()
+    _lock.release()
+    uptime_history.record(node_id, ts, alive)
+
+
+def same_endpoint(a, b):
+    return a is not None and b is not None and (a.ip, a.tcp_port, a.udp_port) == (b.ip, b.tcp_port, b.udp_port)
+
+
+def by_raw_id(nodes):
+    # Snapshots pickled before the node maps were keyed by binary ids are keyed by hex ids.
+    return {node.raw_id: node for node in nodes.values()}
+
+
 def get_node_set():
-    nodes = {}  # Map from id to NodeEndpoint
+    nodes = {}  # Map from binary id to NodeEndpoint
     for date_dir in os.listdir(nodes_dir):
         for root, _, files in os.walk(os.path.join(nodes_dir, date_dir)):
             # In one day, a miner is regarded a trusted node if it appears at any node's trusted_nodes.
             for node_file in sorted(files):
                 if node_file.endswith("trusted_nodes.json"):
-                    with open(os.path.join(root, node_file), "r") as f:
-                        try:
-                            trusted_nodes = json.load(f)
-                        except Exception as e:
-                            logger.warning(f"json load error: {root}, {node_file}")
-                            continue
-                        for node in trusted_nodes["nodes"]:
-                            endpoint = NodeEndpoint.from_url(node["url"])
-                            nodes[endpoint.node_id] = endpoint
+                    nodes.update(parse_trusted_nodes_file(os.path.join(root, node_file)))
     return nodes
 
 
+def parse_trusted_nodes_file(path):
+    nodes = {}
+    with open(path, "r") as f:
+        try:
+            trusted_nodes = json.load(f)
+        except Exception as e:
+            logger.warning(f"json load error: {path}")
+            return nodes
+        for node in trusted_nodes["nodes"]:
+            try:
+                endpoint = NodeEndpoint.from_url(node["url"])
+            except ValueError:
+                logger.warning(f"invalid node url in {path}: {node['url']}")
+                continue
+            nodes[endpoint.raw_id] = endpoint
+    return nodes
+
+
+def ingest_trusted_node_files(paths):
+    """
+    Parse new trusted_nodes.json files, refresh the endpoints of known nodes and probe the nodes seen for the
+    first time, or at a new address, right away. New nodes enter `nodes_map` once a probe finds them alive.
+    """
+    nodes = {}
+    for path in paths:
+        nodes.update(parse_trusted_nodes_file(path))
+    _lock.acquire()
+    moved = []
+    for node_id, node in nodes.items():
+        if node_id in nodes_map and not same_endpoint(nodes_map[node_id], node):
+            nodes_map[node_id] = node
+            moved.append(node_id)
+    if len(moved) != 0:
+        mark_state_changed()
+    _lock.release()
+    new_count = 0
+    for node in nodes.values():
+        if probe_scheduler.add(node):
+            new_count += 1
+    # Their status at the old address says nothing about the new one.
+    for node_id in moved:
+        probe_scheduler.probe_soon(node_id)
+    logger.info(f"ingest {len(paths)} trusted node files, {new_count} new nodes")
+    return new_count
+
+
 def check_single_node(node):
     try:
         tcp_out = subprocess.run(["nc", "-vz", str(node.ip), str(node.tcp_port)],
@@ -103,12 +192,7 @@ def check_single_node(node):
         logger.info(f"node {node.node_id} {node.ip} {node.tcp_port} error")
         logger.info(traceback.format_exc())
         return None
-    ''' UDP check is inaccurate for now.
-    udp_out = subprocess.check_output(["nc", "-vzu", str(node.ip), str(node.udp_port)],
-                                      stderr=subprocess.STDOUT, timeout=5)
-    if "success" not in udp_out:
-        continue
-    '''
+    # The UDP discovery port is checked separately for all nodes at once by `udp_check`.
     if "succeeded" not in tcp_out:
         logger.info(f"node {node.node_id} {node.ip} {node.tcp_port} fail: {tcp_out}")
         return None
@@ -116,90 +200,259 @@ def check_single_node(node):
         return node
 
 
-def check_node_status(nodes):
-    alive_nodes = {}
-    i = 0
-    total = len(nodes)
-    executor = ThreadPoolExecutor(max_workers=12)
-    futures = []
-    for node in nodes.values():
-        futures.append(executor.submit(check_single_node, node))
-    for f in futures:
-        logger.info(f"Check {i} out of {total} nodes")
-        i += 1
-        node = f.result()
-        if node is not None:
-            alive_nodes[node.node_id] = node
-    return alive_nodes
+def udp_check():
+    global udp_alive_nodes
+    _lock.acquire()
+    nodes = list(nodes_map.values())
+    _lock.release()
+    replied = asyncio.run(udp_ping_all(nodes, priv_key=udp_priv_key))
+    logger.info(f"udp check: {len(replied)} out of {len(nodes)} nodes replied")
+    replied = {raw_node_id(node_id) for node_id in replied}
+    _lock.acquire()
+    if replied != udp_alive_nodes:
+        udp_alive_nodes = replied
+        mark_state_changed()
+    _lock.release()
 
 
-def node_status_from_net_key(node_id):
-    _lock.acquire()
+def node_status(node_id):
+    # Must be called with `_lock` held. `node_id` is a binary id, or None for an invalid one.
     if node_id in trusted_nodes_time and node_id in nodes_map:
-        r = json.dumps({
+        return {
             "trusted_days": int(trusted_nodes_time[node_id] / 3600 / 24) + 1,
             "address": f"{nodes_map[node_id].ip}:{nodes_map[node_id].tcp_port}",
-        })
+            "tcp_alive": node_id in latest_alive_nodes,
+            "udp_alive": node_id in udp_alive_nodes,
+        }
     else:
-        r = json.dumps({
+        return {
             "trusted_days": 0,
-        })
+        }
+
+
+def node_status_from_net_key(node_id):
+    _lock.acquire()
+    r = json.dumps(node_status(raw_node_id(node_id)))
     _lock.release()
     return r
 
 
-def trusted_node_ip_list():
+def node_status_batch(node_ids):
     _lock.acquire()
-    ip_set = set()
-    for node in nodes_map.values():
-        ip_set.add(node.ip)
-    ip_list = sorted(list(ip_set))
+    statuses = [node_status(raw_node_id(node_id)) for node_id in node_ids]
     _lock.release()
+    return json.dumps(statuses)
+
+
+def build_trusted_node_ip_list(nodes_map):
+    ip_list = sorted(set(node.ip for node in nodes_map.values()))
     return json.dumps({
         "ip_list": ip_list
     })
 
 
-def trusted_node_list():
-    _lock.acquire()
+def build_trusted_node_list(trusted_nodes_time, nodes_map, latest_alive_nodes, udp_alive_nodes):
     data = []
     for node_id in trusted_nodes_time:
         data.append({
-            "pubkey": node_id,
+            "pubkey": node_id.hex(),
             "ip": nodes_map[node_id].ip,
             "active_period": trusted_nodes_time[node_id],
+            "tcp_alive": node_id in latest_alive_nodes,
+            "udp_alive": node_id in udp_alive_nodes,
         })
-    _lock.release()
     return json.dumps({
         "data": data,
         "active_count": len(latest_alive_nodes),
     })
 
 
-def alive_node_ip_list():
+def build_alive_node_ip_list(latest_alive_nodes):
+    ip_list = sorted(set(node.ip for node in latest_alive_nodes.values()))
+    return json.dumps({
+        "ip_list": ip_list
+    })
+
+
+def mark_state_changed():
+    # Must be called with `_lock` held.
+    global state_version
+    state_version += 1
+
+
+def refresh_responses():
+    """
+    Rebuild the serialized list responses if the state changed since they were last built. Each response's ETag is
+    a hash of its body, so a list whose content did not change keeps its ETag.
+    """
+    global cached_responses
+    _lock.acquire()
+    version = state_version
+    if version == cached_responses[0]:
+        _lock.release()
+        return
+    # The state is copied under the lock and serialized after releasing it.
+    nodes = dict(nodes_map)
+    times = dict(trusted_nodes_time)
+    alive_nodes = dict(latest_alive_nodes)
+    udp_alive = udp_alive_nodes
+    _lock.release()
+    responses = {
+        "trusted_node_ip_list": build_trusted_node_ip_list(nodes),
+        "trusted_node_list": build_trusted_node_list(times, nodes, alive_nodes, udp_alive),
+        "alive_node_ip_list": build_alive_node_ip_list(alive_nodes),
+    }
+    etags = {name: hashlib.sha256(body.encode()).hexdigest()[:16] for name, body in responses.items()}
+    # Replacing the tuple is atomic, so readers never need the lock.
+    cached_responses = (version, responses, etags)
+
+
+def cached_response(name):
+    _, responses, etags = cached_responses
+    return [etags[name], responses[name]]
+
+
+def publish_snapshot():
+    """
+    Write the responses of trust_node_server.py to `snapshot_path` if the state changed since the last snapshot, or
+    else touch it so that readers know it is still current.
+    """
+    global published_version
+    version, responses, etags = cached_responses
+    if version == published_version:
+        touch_snapshot(snapshot_path)
+        return
+    # The statuses are copied under the lock and serialized after releasing it.
     _lock.acquire()
-    ip_set = set()
-    for node in latest_alive_nodes.values():
-        ip_set.add(node.ip)
-    ip_list = sorted(list(ip_set))
+    statuses = [(node_id, node_status(node_id)) for node_id in trusted_nodes_time if node_id in nodes_map]
     _lock.release()
+    blobs = {f"node/{node_id.hex()}": json.dumps(status).encode() for node_id, status in statuses}
+    for name, body in responses.items():
+        blobs[name] = body.encode()
+        blobs[f"etag/{name}"] = etags[name].encode()
+    write_snapshot(snapshot_path, blobs, version)
+    published_version = version
+
+
+def trusted_node_ip_list():
+    return cached_responses[1]["trusted_node_ip_list"]
+
+
+def trusted_node_list():
+    return cached_responses[1]["trusted_node_list"]
+
+
+def alive_node_ip_list():
+    return cached_responses[1]["alive_node_ip_list"]
+
+
+def alive_nodes_at(ts):
+    # Return the timestamp and the alive nodes of the snapshot nearest to `ts`.
+    nearest = alive_ts_index.nearest(float(ts))
+    if nearest is None:
+        return None, {}
+    ts, key = nearest
+    return ts, by_raw_id(alive_node_db[key])
+
+
+def alive_node_list_at(ts):
+    ts, alive_nodes = alive_nodes_at(ts)
     return json.dumps({
-        "ip_list": ip_list
+        "timestamp": ts,
+        "data": [{"pubkey": node.node_id, "ip": node.ip} for node in alive_nodes.values()],
     })
 
 
+def alive_node_diff(from_ts, to_ts):
+    from_ts, from_nodes = alive_nodes_at(from_ts)
+    to_ts, to_nodes = alive_nodes_at(to_ts)
+    return json.dumps({
+        "from_timestamp": from_ts,
+        "to_timestamp": to_ts,
+        "added": sorted(node_id.hex() for node_id in to_nodes.keys() - from_nodes.keys()),
+        "removed": sorted(node_id.hex() for node_id in from_nodes.keys() - to_nodes.keys()),
+    })
+
+
+def node_uptime(node_id, start, end):
+    return json.dumps(uptime_history.query(raw_node_id(node_id), float(start), float(end)))
+
+
+def async_http_server(port):
+    """The routes of trust_node_server.py, served straight from this process without uwsgi and XML-RPC."""
+    server = AsyncHttpServer("0.0.0.0", port)
+
+    @server.route('/node-status-from-net-key', blocking=True)
+    def http_node_status_from_net_key(request):
+        node_id = node_id_or_none(request.arg("key"))
+        if node_id is None:
+            return "{}"
+        return node_status_from_net_key(node_id)
+
+    @server.route('/node-status-batch', methods=("POST",), blocking=True)
+    def http_node_status_batch(request):
+        keys, node_ids = parse_batch(request.json())
+        return batch_response(keys, node_ids, lambda lookup_ids: json.loads(node_status_batch(lookup_ids)),
+                              key_executor.map)
+
+    def http_cached_response(name):
+        version, body = cached_response(name)
+        return Response(body, etag=f"{name}-{version}")
+
+    @server.route('/trusted-node-ip-list')
+    def http_trusted_node_ip_list(request):
+        return http_cached_response("trusted_node_ip_list")
+
+    @server.route('/trusted-node-list')
+    def http_trusted_node_list(request):
+        return http_cached_response("trusted_node_list")
+
+    @server.route('/alive-node-ip-list')
+    def http_alive_node_ip_list(request):
+        return http_cached_response("alive_node_ip_list")
+
+    @server.route('/node-uptime')
+    def http_node_uptime(request):
+        return node_uptime(node_id_arg(request.arg), number_arg(request.arg, "start", 0),
+                           number_arg(request.arg, "end", time.time()))
+
+    @server.route('/alive-nodes-at')
+    def http_alive_nodes_at(request):
+        return alive_node_list_at(number_arg(request.arg, "timestamp", time.time(), int))
+
+    @server.route('/alive-nodes-diff')
+    def http_alive_nodes_diff(request):
+        return alive_node_diff(number_arg(request.arg, "from", kind=int),
+                               number_arg(request.arg, "to", time.time(), int))
+
+    return server
+
+
 def start_rpc_server():
     server = SimpleXMLRPCServer(('localhost', LOCAL_PORT), logRequests=True)
     server.register_function(node_status_from_net_key)
+    server.register_function(node_status_batch)
     server.register_function(trusted_node_ip_list)
     server.register_function(trusted_node_list)
     server.register_function(alive_node_ip_list)
+    server.register_function(cached_response)
+    server.register_function(node_uptime)
+    server.register_function(alive_node_list_at)
+    server.register_function(alive_node_diff)
     server.serve_forever()
 
 
 def periodic_run():
+    last_snapshot = 0
     while True:
         schedule.run_pending()
+        refresh_responses()
+        if time.time() - last_snapshot >= SNAPSHOT_INTERVAL_SECONDS:
+            last_snapshot = time.time()
+            try:
+                publish_snapshot()
+            except Exception as e:
+                logger.warning(f"publish snapshot failed: {e}")
         time.sleep(1)
 
 
@@ -207,22 +460,57 @@ if __name__ == "__main__":
     setup_log()
     nodes_dir = "trusted_nodes"
     logger = logging.getLogger("node_server")
-    # Map from timestamp to all trusted_nodes
+    # Map from timestamp to the trusted nodes probed in the hour before it
     node_db = sqlitedict.SqliteDict("node.db", tablename="all", autocommit=True)
     alive_node_db = sqlitedict.SqliteDict("node.db", tablename="alive", autocommit=True)
+    # Sorted keys of alive_node_db
+    alive_ts_index = TimestampIndex()
 
     trusted_nodes_time = {}
     nodes_map = {}
     latest_alive_nodes = {}
+    # The bitmaps start at the first sweep in node.db, or now on the first run.
+    uptime_history = UptimeHistory(UPDATE_INTERVAL_HOUR * 3600,
+                                   min((float(ts) for ts in node_db.keys()), default=time.time()))
     _lock = threading.Lock()
 
+    # Map from node id to the timestamp of its latest probe
+    last_probe_ts = {}
+    # Map from node id to endpoint of the nodes probed since the latest `update`
+    probed_since_update = {}
+    probe_scheduler = ProbeScheduler(check_single_node, on_probe_result, max_interval=PROBE_MAX_INTERVAL_SECONDS)
+    # Node ids that answered the latest UDP discovery ping
+    udp_alive_nodes = set()
+    udp_priv_key = os.urandom(32)
+    # Bumped whenever the state behind the list responses changes
+    state_version = 0
+    # (state_version, {name: serialized response}, {name: ETag}) of the list endpoints
+    cached_responses = (-1, {}, {})
+    # Read by the uwsgi workers of trust_node_server.py
+    snapshot_path = os.environ.setdefault("SNAPSHOT_FILE", "node_snapshot.bin")
+    # state_version of the latest snapshot
+    published_version = -1
+    # A snapshot left by an earlier run is stale until this one has recovered.
+    remove_snapshot(snapshot_path)
+
     global_last_ts = time.time()
     global_last_ts = recover()
+    probe_scheduler.start()
+    DirWatcher(nodes_dir, ingest_trusted_node_files).start()
     schedule.every(UPDATE_INTERVAL_HOUR).hours.do(update)
+    schedule.every(UDP_CHECK_INTERVAL_MINUTE).minutes.do(udp_check)
     threading.Thread(target=periodic_run, daemon=True).start()
 
     LOCAL_PORT = 9002
     PUBLIC_PORT = 4002
+    ASYNC_PUBLIC_PORT = 4102
     os.environ["LOCAL_PORT"] = str(LOCAL_PORT)
-    subprocess.Popen(["uwsgi", "--http", f"0.0.0.0:{PUBLIC_PORT}", "--module", "trust_node_server:app"])
+    # "uwsgi" (default), "async" for the built-in server on PUBLIC_PORT, or "both" to compare them, with the
+    # built-in server on ASYNC_PUBLIC_PORT. The XML-RPC server is always started.
+    http_frontend = os.getenv("HTTP_FRONTEND", "uwsgi")
+    if http_frontend in ("uwsgi", "both"):
+        subprocess.Popen(["uwsgi", "--http", f"0.0.0.0:{PUBLIC_PORT}", "--module", "trust_node_server:app",
+                          "--processes", os.getenv("HTTP_PROCESSES", "4")])
+    if http_frontend in ("async", "both"):
+        async_http_server(PUBLIC_PORT if http_frontend == "async" else ASYNC_PUBLIC_PORT).start()
     start_rpc_server()
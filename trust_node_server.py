@@ -1,11 +1,17 @@
+import json
 import logging
 import threading
+from concurrent.futures.thread import ThreadPoolExecutor
 from xmlrpc.client import ServerProxy
 
-from flask import Flask, request
-from utils.utils import setup_log, priv_to_pub, encode_hex
+from flask import Flask, make_response, request
+from utils.mmap_snapshot import SnapshotReader
+from utils.node_key import node_id_from_key
+from utils.common import HttpError, setup_log
+from utils.node_requests import batch_response, node_id_arg, number_arg, parse_batch
 from flask_cors import CORS
 import os
+import time
 
 
 setup_log()
@@ -13,29 +19,98 @@ app = Flask(__name__)
 CORS(app)
 LOCAL_PORT = os.getenv('LOCAL_PORT')
 node_status_fetcher = ServerProxy(f'http://localhost:{LOCAL_PORT}')
+key_executor = ThreadPoolExecutor(max_workers=8)
+# Responses and node statuses published by the fetcher, read without RPC when there is a snapshot.
+snapshot = SnapshotReader(os.environ["SNAPSHOT_FILE"]) if os.getenv("SNAPSHOT_FILE") else None
+
+
+@app.errorhandler(HttpError)
+def http_error(e):
+    return e.args[0], e.status, {"Content-Type": "text/plain"}
+
+
+def current_snapshot():
+    return snapshot.current() if snapshot is not None else None
+
+
+def node_statuses(node_ids):
+    snap = current_snapshot()
+    if snap is None:
+        return json.loads(node_status_fetcher.node_status_batch(node_ids))
+    statuses = []
+    for node_id in node_ids:
+        # The snapshot has every trusted node, so the others are untrusted.
+        blob = snap.get(f"node/{node_id}")
+        statuses.append(json.loads(bytes(blob)) if blob is not None else {"trusted_days": 0})
+    return statuses
 
 
 @app.route('/node-status-from-net-key', methods=['GET'])
 def node_status_from_net_key():
     prikey = request.args.get("key")
     try:
-        node_id = encode_hex(priv_to_pub(prikey))
+        node_id = node_id_from_key(prikey)
     except:
         print("Invalid key format: ", prikey)
         return "{}"
+    if current_snapshot() is not None:
+        return json.dumps(node_statuses([node_id])[0])
     return node_status_fetcher.node_status_from_net_key(node_id)
 
 
+@app.route('/node-status-batch', methods=['POST'])
+def node_status_batch():
+    """
+    Take `{"keys": [...], "node_ids": [...]}` and return `{"keys": [...], "node_ids": [...]}` with the status of
+    each entry in the same order. Invalid keys get `{}`.
+    """
+    keys, node_ids = parse_batch(request.get_json(force=True))
+    return batch_response(keys, node_ids, node_statuses, key_executor.map)
+
+
+def cached_response(name):
+    # The ETag is a hash of the body, so unchanged lists are answered with 304.
+    snap = current_snapshot()
+    if snap is not None:
+        version, body = bytes(snap.get(f"etag/{name}")).decode(), bytes(snap.get(name))
+    else:
+        version, body = node_status_fetcher.cached_response(name)
+    response = make_response(body)
+    response.mimetype = "application/json"
+    response.set_etag(f"{name}-{version}")
+    return response.make_conditional(request)
+
+
 @app.route('/trusted-node-ip-list', methods=['GET'])
 def trusted_node_ip_list():
-    return node_status_fetcher.trusted_node_ip_list()
+    return cached_response("trusted_node_ip_list")
 
 
 @app.route('/trusted-node-list', methods=['GET'])
 def trusted_node_list():
-    return node_status_fetcher.trusted_node_list()
+    return cached_response("trusted_node_list")
 
 
 @app.route('/alive-node-ip-list', methods=['GET'])
 def alive_node_ip_list():
-    return node_status_fetcher.alive_node_ip_list()
\ No newline at end of file
+    return cached_response("alive_node_ip_list")
+
+
+@app.route('/node-uptime', methods=['GET'])
+def node_uptime():
+    node_id = node_id_arg(request.args.get)
+    start = number_arg(request.args.get, "start", 0)
+    end = number_arg(request.args.get, "end", time.time())
+    return node_status_fetcher.node_uptime(node_id, start, end)
+
+
+@app.route('/alive-nodes-at', methods=['GET'])
+def alive_nodes_at():
+    return node_status_fetcher.alive_node_list_at(number_arg(request.args.get, "timestamp", time.time(), int))
+
+
+@app.route('/alive-nodes-diff', methods=['GET'])
+def alive_nodes_diff():
+    from_ts = number_arg(request.args.get, "from", kind=int)
+    to_ts = number_arg(request.args.get, "to", time.time(), int)
+    return node_status_fetcher.alive_node_diff(from_ts, to_ts)
@@ -0,0 +1,143 @@
+"""
+Fetch trusted_nodes.json from all hosts concurrently into the trusted_nodes/ directory watched by the node service.
+
+    python3 trusted_node_collector.py [--hosts host_work_dirs] [--local DIR]
+
+Each line of the hosts file is `user ip work_dir`. Every fetched file is stored as
+`trusted_nodes/<date>/<ip>-trusted_nodes.json`, because trusted days are counted per date directory. Only the files
+whose content hash changed since the last run are written; unchanged files are hard links to the previous copy, which
+the node service's watcher does not ingest again.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures.thread import ThreadPoolExecutor
+
+from utils.common import setup_log
+
+logger = logging.getLogger("collector")
+
+NODES_DIR = "trusted_nodes"
+# Outside of NODES_DIR, whose entries are all read as date directories
+HASH_FILE = "collector_hashes.json"
+
+
+class SshSource:
+    def __init__(self, user, ip, work_dir, key_file="/home/ubuntu/.ssh/id_rsa"):
+        self.name = ip
+        self.user = user
+        self.ip = ip
+        self.work_dir = work_dir
+        self.key_file = key_file
+
+    def fetch(self, timeout):
+        return subprocess.run(
+            ["ssh", "-o", "StrictHostKeyChecking no", "-o", f"ConnectTimeout={int(timeout)}", "-i", self.key_file,
+             f"{self.user}@{self.ip}", f"cat {self.work_dir}/net_config/trusted_nodes.json"],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout, check=True).stdout
+
+
+class LocalDirSource:
+    """Read `<root>/<name>/net_config/trusted_nodes.json`, used for tests instead of real hosts."""
+    def __init__(self, root, name):
+        self.name = name
+        self.path = os.path.join(root, name, "net_config", "trusted_nodes.json")
+
+    def fetch(self, timeout):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def sources_from_hosts_file(path):
+    sources = []
+    with open(path, "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3:
+                sources.append(SshSource(*fields))
+    return sources
+
+
+def sources_from_local_dir(root):
+    return [LocalDirSource(root, name) for name in sorted(os.listdir(root))]
+
+
+class Collector:
+    def __init__(self, sources, nodes_dir=NODES_DIR, hash_file=HASH_FILE, timeout=30, max_workers=16):
+        self.sources = sources
+        self.nodes_dir = nodes_dir
+        self.hash_file = hash_file
+        self.timeout = timeout
+        self.max_workers = max_workers
+        # Map from source name to {"sha256": ..., "path": ...} of its latest stored file
+        self.hashes = {}
+        if os.path.exists(hash_file):
+            with open(hash_file, "r") as f:
+                self.hashes = json.load(f)
+
+    def _fetch(self, source):
+        try:
+            return source, source.fetch(self.timeout)
+        except Exception as e:
+            logger.warning(f"fetch from {source.name} failed: {e}")
+            return source, None
+
+    @staticmethod
+    def _write_file(path, content):
+        # Replace rather than overwrite, so that a file hard linked from an earlier day is left as it is.
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _store_unchanged(self, previous_path, path, content):
+        if os.path.exists(path):
+            return
+        try:
+            os.link(previous_path, path)
+        except OSError:
+            self._write_file(path, content)
+
+    def collect(self):
+        """Fetch from all sources, store every file in today's directory and return the paths of the changed ones."""
+        db_dir = os.path.join(self.nodes_dir, time.strftime("%Y.%m.%d"))
+        os.makedirs(db_dir, exist_ok=True)
+        new_files = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for source, content in executor.map(self._fetch, self.sources):
+                if content is None:
+                    continue
+                digest = hashlib.sha256(content).hexdigest()
+                path = os.path.join(db_dir, f"{source.name}-trusted_nodes.json")
+                previous = self.hashes.get(source.name)
+                if previous is not None and previous["sha256"] == digest:
+                    logger.debug(f"{source.name} unchanged")
+                    self._store_unchanged(previous["path"], path, content)
+                else:
+                    self._write_file(path, content)
+                    new_files.append(os.path.abspath(path))
+                self.hashes[source.name] = {"sha256": digest, "path": path}
+        tmp_file = self.hash_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.hashes, f)
+        os.replace(tmp_file, self.hash_file)
+        logger.info(f"collected {len(new_files)} changed files from {len(self.sources)} sources")
+        return new_files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hosts", default="host_work_dirs")
+    parser.add_argument("--local", help="read from local directories instead of ssh")
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+    setup_log()
+    if args.local:
+        sources = sources_from_local_dir(args.local)
+    else:
+        sources = sources_from_hosts_file(args.hosts)
+    Collector(sources, timeout=args.timeout).collect()
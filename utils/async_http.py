@@ -0,0 +1,242 @@
+import asyncio
+import json
+import logging
+import re
+import threading
+import traceback
+from http import HTTPStatus
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from utils.common import HttpError
+
+logger = logging.getLogger("async_http")
+
+MAX_HEADER_BYTES = 64 << 10
+MAX_BODY_BYTES = 16 << 20
+KEEPALIVE_TIMEOUT = 30
+
+
+class Request:
+    def __init__(self, method, path, query, headers, body):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def arg(self, name, default=None):
+        values = self.query.get(name)
+        return values[0] if values else default
+
+    def json(self):
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            raise HttpError(400, "invalid json body")
+
+
+class Response:
+    def __init__(self, body, status=200, content_type="application/json", etag=None, headers=None):
+        self.body = body.encode() if isinstance(body, str) else body
+        self.status = status
+        self.content_type = content_type
+        self.etag = etag
+        self.headers = headers or {}
+
+
+class StreamResponse:
+    """
+    A response whose body is written from the async iterator `chunks` (of str) until it ends or the client leaves.
+    `on_close` is then called, even if the iterator was never started.
+    """
+    def __init__(self, chunks, content_type="text/event-stream", headers=None, on_close=None):
+        self.chunks = chunks
+        self.content_type = content_type
+        self.headers = headers or {}
+        self.on_close = on_close
+
+
+class AsyncHttpServer:
+    """
+    A minimal HTTP/1.1 server on asyncio, so that a process can serve its in-memory state directly.
+
+    Handlers are registered with `route` and called as `handler(request, **path_params)`. They return a str
+    (sent as JSON), a dict (serialized to JSON), a Response or a StreamResponse. Handlers run on the event loop and
+    must be quick; register CPU-bound ones with `blocking=True` to run them in the loop's thread pool instead.
+    Connections are kept alive, and a Response with an `etag` is answered with 304 if it matches If-None-Match.
+    """
+    def __init__(self, host, port, cors=True):
+        self.host = host
+        self.port = port
+        self.cors = cors
+        # List of (method, compiled path pattern, handler, blocking)
+        self._routes = []
+
+    def route(self, path, methods=("GET",), blocking=False):
+        pattern = re.compile("^" + re.sub(r"<(\w+)>", r"(?P<\1>[^/]+)", path) + "$")
+
+        def register(handler):
+            for method in methods:
+                self._routes.append((method, pattern, handler, blocking))
+            return handler
+        return register
+
+    def start(self):
+        threading.Thread(target=lambda: asyncio.run(self.serve_forever()), daemon=True).start()
+
+    async def serve_forever(self):
+        server = await asyncio.start_server(self._serve_connection, self.host, self.port, limit=MAX_HEADER_BYTES)
+        logger.info(f"async http server listening on {self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request, keep_alive = await asyncio.wait_for(self._read_request(reader), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except HttpError as e:
+                    await self._write_response(writer, Response(e.args[0], e.status, "text/plain"), False)
+                    break
+                if request is None:
+                    break
+                response = await self._handle(request)
+                if isinstance(response, StreamResponse):
+                    await self._write_stream(reader, writer, response)
+                    break
+                await self._write_response(writer, response, keep_alive, request)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HttpError(431, "request header too large")
+        except asyncio.IncompleteReadError as e:
+            if len(e.partial) == 0:
+                return None, False
+            raise
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "invalid request line")
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+        # The connection is closed after these errors, so the unread body does not matter.
+        if "transfer-encoding" in headers:
+            raise HttpError(411, "a request body needs a content-length")
+        length = headers.get("content-length", "0") or "0"
+        if not length.isdigit():
+            raise HttpError(400, f"invalid content-length: {length}")
+        length = int(length)
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, "request body too large")
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return Request(method, unquote(url.path), parse_qs(url.query), headers, body), keep_alive
+
+    async def _handle(self, request):
+        if request.method == "OPTIONS" and self.cors:
+            return Response(b"", 204, headers={
+                "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+                "Access-Control-Allow-Headers": request.headers.get("access-control-request-headers", "*"),
+            })
+        path_matched = False
+        for method, pattern, handler, blocking in self._routes:
+            match = pattern.match(request.path)
+            if match is None:
+                continue
+            path_matched = True
+            if method != request.method:
+                continue
+            try:
+                if blocking:
+                    result = await asyncio.get_event_loop().run_in_executor(
+                        None, lambda: handler(request, **match.groupdict()))
+                else:
+                    result = handler(request, **match.groupdict())
+            except HttpError as e:
+                return Response(e.args[0], e.status, "text/plain")
+            except Exception:
+                logger.warning(f"{request.method} {request.path}: {traceback.format_exc()}")
+                return Response("internal server error", 500, "text/plain")
+            if isinstance(result, (Response, StreamResponse)):
+                return result
+            if isinstance(result, (dict, list)):
+                result = json.dumps(result)
+            return Response(result)
+        if path_matched:
+            return Response("method not allowed", 405, "text/plain")
+        return Response("not found", 404, "text/plain")
+
+    def _head(self, status, content_type, headers):
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", f"Content-Type: {content_type}"]
+        if self.cors:
+            lines.append("Access-Control-Allow-Origin: *")
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        return lines
+
+    async def _write_response(self, writer, response, keep_alive, request=None):
+        status = response.status
+        headers = dict(response.headers)
+        body = response.body
+        if response.etag is not None:
+            etag = f'"{response.etag}"'
+            headers["ETag"] = etag
+            if request is not None and request.headers.get("if-none-match") == etag:
+                status = 304
+                body = b""
+        headers["Content-Length"] = len(body)
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        head = "\r\n".join(self._head(status, response.content_type, headers)) + "\r\n\r\n"
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def _write_stream(self, reader, writer, response):
+        headers = dict(response.headers, Connection="close")
+        head = "\r\n".join(self._head(200, response.content_type, headers)) + "\r\n\r\n"
+        # Stop as soon as the client leaves, rather than on the next write, which may be long after.
+        writing = asyncio.ensure_future(self._write_chunks(writer, head, response.chunks))
+        leaving = asyncio.ensure_future(self._wait_eof(reader))
+        try:
+            await asyncio.wait([writing, leaving], return_when=asyncio.FIRST_COMPLETED)
+            if writing.done():
+                writing.result()
+        finally:
+            writing.cancel()
+            leaving.cancel()
+            # Let the cancelled writer leave the iterator before closing it.
+            await asyncio.wait([writing, leaving])
+            try:
+                await response.chunks.aclose()
+            finally:
+                if response.on_close is not None:
+                    response.on_close()
+
+    @staticmethod
+    async def _write_chunks(writer, head, chunks):
+        writer.write(head.encode("latin-1"))
+        async for chunk in chunks:
+            writer.write(chunk.encode())
+            await writer.drain()
+
+    @staticmethod
+    async def _wait_eof(reader):
+        try:
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
@@ -0,0 +1,27 @@
+class BlockHashIndex:
+    """
+    In-memory set of known block hashes.
+
+    Hashes are given as hex strings and kept as 32-byte binary keys, which take about half the memory of the strings.
+    """
+    def __init__(self):
+        self._hashes = set()
+
+    @staticmethod
+    def _key(block_hash):
+        return bytes.fromhex(block_hash[2:] if block_hash.startswith("0x") else block_hash)
+
+    def add(self, block_hash):
+        self._hashes.add(self._key(block_hash))
+
+    def update(self, block_hashes):
+        self._hashes.update(self._key(block_hash) for block_hash in block_hashes)
+
+    def discard(self, block_hash):
+        self._hashes.discard(self._key(block_hash))
+
+    def __contains__(self, block_hash):
+        return self._key(block_hash) in self._hashes
+
+    def __len__(self):
+        return len(self._hashes)
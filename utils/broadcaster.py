@@ -0,0 +1,58 @@
+import asyncio
+import threading
+
+
+class Broadcaster:
+    """
+    Fan out events published from any thread to subscribers running on asyncio event loops.
+
+    `subscribe()` must be called on the subscriber's loop. It returns an asyncio.Queue of `(version, event)` items, or
+    None if `max_subscribers` are already subscribed. `publish` hands each event to every subscriber as is, so an
+    event is built once however many subscribers there are. A subscriber that falls `queue_size` events behind has
+    its queue cleared and gets a None item instead, telling it to start over from the current state.
+    """
+    def __init__(self, max_subscribers=1000, queue_size=64):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        # Map from queue to the loop it belongs to
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        loop = asyncio.get_event_loop()
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers[queue] = loop
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def publish(self, version, event):
+        by_loop = {}
+        with self._lock:
+            for queue, loop in self._subscribers.items():
+                by_loop.setdefault(loop, []).append(queue)
+        for loop, queues in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(self._offer, queues, (version, event))
+            except RuntimeError:
+                # The loop is closed, so are its subscribers.
+                for queue in queues:
+                    self.unsubscribe(queue)
+
+    @staticmethod
+    def _offer(queues, item):
+        for queue in queues:
+            if queue.full():
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+            else:
+                queue.put_nowait(item)
@@ -0,0 +1,50 @@
+"""
+Helpers needed by every service, including the HTTP workers.
+
+This module only imports the standard library so that workers start quickly. The crypto and encoding helpers are in
+utils.utils, which pulls in eth_utils, py_ecc, rlp, coincurve and sha3; import it only where those are needed.
+"""
+import datetime
+import json
+import logging
+import sys
+import time
+
+
+class HttpError(Exception):
+    """A client error, answered with `status` and the message by both the Flask apps and utils.async_http."""
+    def __init__(self, status, message=""):
+        super().__init__(message)
+        self.status = status
+
+
+def pubsub_url(host="127.0.0.1", port=12535):
+    return "ws://%s:%d" % (host, int(port))
+
+
+def http_rpc_url(host="127.0.0.1", port=12537):
+    return "http://%s:%d" % (host, int(port))
+
+
+def setup_log():
+    fh = logging.FileHandler("server.log")
+    ch = logging.StreamHandler(sys.stdout)
+    formatter = logging.Formatter(
+        fmt=
+        '%(asctime)s.%(msecs)03dZ %(name)s %(process)d %(thread)d (%(levelname)s): %(message)s',
+        datefmt='%Y-%m-%dT%H:%M:%S')
+    fh.setFormatter(formatter)
+    ch.setFormatter(formatter)
+    ch.setLevel("INFO")
+    fh.setLevel("DEBUG")
+    logging.root.addHandler(ch)
+    logging.root.addHandler(fh)
+    logging.root.setLevel("DEBUG")
+
+
+def parse_date(s):
+    return time.mktime(datetime.datetime.strptime(s, "%H:%M-%d/%m/%Y").timetuple())
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
@@ -0,0 +1,120 @@
+import logging
+import os
+import threading
+import time
+import traceback
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+logger = logging.getLogger("dir_watcher")
+
+
+class DirWatcher:
+    """
+    Watch a directory tree and call `callback(paths)` with the files ending with `suffix` that were created or
+    rewritten since the watcher started.
+
+    Uses inotify when `inotify_simple` is installed and falls back to polling every `poll_interval` seconds
+    otherwise. Changes are debounced: the callback runs once no new change has been seen for `debounce` seconds, with
+    all the paths of the burst. A new hard link to a file that was already seen is not a change.
+    """
+    def __init__(self, root, callback, suffix="trusted_nodes.json", debounce=2.0, poll_interval=5.0):
+        self.root = root
+        self.callback = callback
+        self.suffix = suffix
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._pending = set()
+        self._last_change = 0
+        # Map from (device, inode) to (mtime, size) of the files seen so far
+        self._seen = {}
+
+    def start(self):
+        target = self._run_inotify if INotify is not None else self._run_polling
+        threading.Thread(target=target, daemon=True).start()
+
+    def _add_pending(self, path):
+        if not path.endswith(self.suffix):
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        inode = (stat.st_dev, stat.st_ino)
+        version = (stat.st_mtime, stat.st_size)
+        if self._seen.get(inode) == version:
+            return
+        self._seen[inode] = version
+        self._pending.add(path)
+        self._last_change = time.time()
+
+    def _flush_if_quiet(self):
+        if self._pending and time.time() - self._last_change >= self.debounce:
+            paths = sorted(self._pending)
+            self._pending.clear()
+            try:
+                self.callback(paths)
+            except Exception:
+                logger.warning(traceback.format_exc())
+
+    def _scan(self):
+        files = {}
+        for root, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(self.suffix):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files[path] = (stat.st_dev, stat.st_ino, stat.st_mtime, stat.st_size)
+        return files
+
+    def _remember(self, files):
+        for dev, ino, mtime, size in files.values():
+            self._seen[(dev, ino)] = (mtime, size)
+
+    def _run_polling(self):
+        logger.info(f"watch {self.root} by polling every {self.poll_interval}s")
+        known = self._scan()
+        self._remember(known)
+        while True:
+            time.sleep(self.poll_interval)
+            current = self._scan()
+            for path, stat in current.items():
+                if known.get(path) != stat:
+                    self._add_pending(path)
+            known = current
+            self._flush_if_quiet()
+
+    def _run_inotify(self):
+        logger.info(f"watch {self.root} with inotify")
+        inotify = INotify()
+        dir_mask = flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO
+        watches = {}
+
+        def add_watch(path):
+            watches[inotify.add_watch(path, dir_mask)] = path
+
+        for root, _, _ in os.walk(self.root):
+            add_watch(root)
+        self._remember(self._scan())
+        while True:
+            for event in inotify.read(timeout=int(self.debounce * 1000)):
+                parent = watches.get(event.wd)
+                if parent is None:
+                    continue
+                path = os.path.join(parent, event.name)
+                if event.mask & flags.ISDIR:
+                    if event.mask & (flags.CREATE | flags.MOVED_TO):
+                        # Files may have been written before the watch on the new directory was added.
+                        for root, _, names in os.walk(path):
+                            add_watch(root)
+                            for name in names:
+                                self._add_pending(os.path.join(root, name))
+                elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                    self._add_pending(path)
+            self._flush_if_quiet()
@@ -0,0 +1,123 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b"SNAPSHT1"
+# magic, generation, entry count
+_HEADER = struct.Struct(">8sQI")
+# key offset, key length, value offset, value length
+_ENTRY = struct.Struct(">QIQI")
+# Snapshots not written or touched for this many seconds are ignored by readers: their writer is gone or stuck.
+MAX_AGE_SECONDS = 60
+
+
+def write_snapshot(path, blobs, generation):
+    """
+    Write `blobs` (a dict from str key to bytes) to `path` as an immutable snapshot.
+
+    Layout: the header, then one table entry per key sorted by key, then the keys, then the values. The file is
+    written next to `path` and renamed over it, so readers see either the old or the new snapshot, never a mix.
+    """
+    keys = sorted(key.encode() for key in blobs)
+    values = [blobs[key.decode()] for key in keys]
+    key_start = _HEADER.size + _ENTRY.size * len(keys)
+    value_start = key_start + sum(len(key) for key in keys)
+    table = []
+    key_offset = key_start
+    value_offset = value_start
+    for key, value in zip(keys, values):
+        table.append(_ENTRY.pack(key_offset, len(key), value_offset, len(value)))
+        key_offset += len(key)
+        value_offset += len(value)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, generation, len(keys)))
+        f.writelines(table)
+        f.writelines(keys)
+        f.writelines(values)
+    os.replace(tmp_path, path)
+
+
+def touch_snapshot(path):
+    """Mark the snapshot at `path` as still current, for writers that only rewrite it when it changes."""
+    os.utime(path)
+
+
+def remove_snapshot(path):
+    """Remove the snapshot at `path`, e.g. one left by an earlier run, so that readers stop serving it."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class Snapshot:
+    """One memory-mapped snapshot file. `get` returns memoryviews into the mapping, so nothing is copied."""
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.generation, self.count = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a snapshot file")
+        self._view = memoryview(self._mmap)
+
+    def _entry(self, i):
+        return _ENTRY.unpack_from(self._mmap, _HEADER.size + _ENTRY.size * i)
+
+    def get(self, key):
+        key = key.encode()
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key_offset, key_len, value_offset, value_len = self._entry(mid)
+            mid_key = self._mmap[key_offset:key_offset + key_len]
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return self._view[value_offset:value_offset + value_len]
+        return None
+
+
+class SnapshotReader:
+    """
+    Serve reads from the latest snapshot at `path`, checking at most every `check_interval` seconds whether it
+    was replaced. `get` returns None if there is no snapshot, it was not written or touched in the last `max_age`
+    seconds, or it has no such key.
+    """
+    def __init__(self, path, check_interval=1.0, max_age=MAX_AGE_SECONDS):
+        self.path = path
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._snapshot = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def current(self):
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval and self._lock.acquire(blocking=False):
+            try:
+                self._checked_at = now
+                st = os.stat(self.path)
+                if time.time() - st.st_mtime > self.max_age:
+                    self._snapshot = None
+                elif self._snapshot is None or self._snapshot.inode != st.st_ino:
+                    # The old mapping is unmapped once the views handed out from it are released.
+                    self._snapshot = Snapshot(self.path)
+            except FileNotFoundError:
+                self._snapshot = None
+            except (OSError, ValueError):
+                pass
+            finally:
+                self._lock.release()
+        return self._snapshot
+
+    def get(self, key):
+        snapshot = self.current()
+        if snapshot is None:
+            return None
+        return snapshot.get(key)
@@ -0,0 +1,59 @@
+import sys
+
+
+def raw_node_id(node_id):
+    """Return the binary form of the hex `node_id`, or None if it is not valid hex."""
+    try:
+        return bytes.fromhex(node_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _restore_endpoint(raw_id, ip, tcp_port, udp_port):
+    endpoint = NodeEndpoint.__new__(NodeEndpoint)
+    endpoint.raw_id = raw_id
+    endpoint.ip = sys.intern(ip)
+    endpoint.tcp_port = tcp_port
+    endpoint.udp_port = udp_port
+    return endpoint
+
+
+class NodeEndpoint:
+    """
+    A node's id and address, stored compactly: the 64-byte binary node id, the interned IP string and integer ports.
+
+    The node maps are keyed by `raw_id` too, so that they share it with the endpoints. `node_id` is the hex form used
+    in responses and logs, derived on each access.
+    """
+    __slots__ = ("raw_id", "ip", "tcp_port", "udp_port")
+
+    def __init__(self, node_id, ip, tcp_port, udp_port):
+        self.raw_id = bytes.fromhex(node_id)
+        self.ip = sys.intern(ip)
+        self.tcp_port = int(tcp_port)
+        self.udp_port = int(udp_port)
+
+    @property
+    def node_id(self):
+        return self.raw_id.hex()
+
+    @classmethod
+    def from_url(cls, url: str):
+        node_id = url[10:138]
+        ip_port = url[139:].split(":")
+        ip = ip_port[0]
+        ports = ip_port[1].split("+")
+        if len(ports) == 1:
+            return cls(node_id, ip, ports[0], ports[0])
+        else:
+            return cls(node_id, ip, ports[0], ports[1])
+
+    def __reduce__(self):
+        return _restore_endpoint, (self.raw_id, self.ip, self.tcp_port, self.udp_port)
+
+    def __setstate__(self, state):
+        # Endpoints pickled before the compact layout carry their attributes as a dict of strings.
+        self.__init__(state["node_id"], state["ip"], state["tcp_port"], state["udp_port"])
+
+    def __repr__(self):
+        return f"NodeEndpoint({self.node_id}, {self.ip}, {self.tcp_port}, {self.udp_port})"
@@ -0,0 +1,65 @@
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+
+NODE_ID_CACHE_SIZE = 1 << 16
+
+
+# The crypto libraries are imported on first use, so that importing this module is cheap for the HTTP workers.
+@functools.lru_cache(maxsize=None)
+def _coincurve():
+    try:
+        import coincurve
+    except ImportError:
+        return None
+    return coincurve if hasattr(coincurve, "PrivateKey") else None
+
+
+def _normalize_key(key):
+    from utils.utils import normalize_key
+    return normalize_key(key)
+
+
+def derive_node_id(key):
+    """Return the hex node id (uncompressed public key without prefix) of a private key."""
+    from utils.utils import encode_hex, priv_to_pub
+    k = _normalize_key(key)
+    coincurve = _coincurve()
+    if coincurve is not None:
+        return encode_hex(coincurve.PrivateKey(k).public_key.format(compressed=False)[1:])
+    return encode_hex(priv_to_pub(k))
+
+
+class NodeIdCache:
+    """
+    Bounded LRU cache of private key -> node id.
+
+    Entries are keyed by a hash of the normalized key so the raw secrets are not kept in memory.
+    """
+    def __init__(self, max_size=NODE_ID_CACHE_SIZE):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        k = _normalize_key(key)
+        digest = hashlib.sha256(k).digest()
+        with self._lock:
+            node_id = self._cache.get(digest)
+            if node_id is not None:
+                self._cache.move_to_end(digest)
+                return node_id
+        node_id = derive_node_id(k)
+        with self._lock:
+            self._cache[digest] = node_id
+            if len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return node_id
+
+
+_node_id_cache = NodeIdCache()
+
+
+def node_id_from_key(key):
+    return _node_id_cache.get(key)
@@ -0,0 +1,77 @@
+"""
+Request parsing shared by trust_node_server.py and the built-in HTTP server of node_status_fetcher.py.
+
+`arg` is the front end's query argument getter, called as `arg(name, default)`. Invalid requests raise HttpError.
+"""
+import math
+
+from utils.common import HttpError
+from utils.node_key import node_id_from_key
+
+# Most entries (keys and node ids together) in one /node-status-batch request
+MAX_BATCH_SIZE = 1000
+
+
+def normalize_node_id(node_id):
+    return node_id.lower().replace("0x", "", 1)
+
+
+def node_id_arg(arg, name="node_id"):
+    node_id = arg(name, None)
+    if not node_id:
+        raise HttpError(400, f"missing {name}")
+    return normalize_node_id(node_id)
+
+
+def number_arg(arg, name, default=None, kind=float):
+    value = arg(name, None)
+    if value is None:
+        if default is None:
+            raise HttpError(400, f"missing {name}")
+        return kind(default)
+    try:
+        number = kind(value)
+    except ValueError:
+        raise HttpError(400, f"invalid {name}: {value}")
+    if not math.isfinite(number):
+        raise HttpError(400, f"invalid {name}: {value}")
+    return number
+
+
+def parse_batch(body):
+    """Return the keys and the normalized node ids of a `{"keys": [...], "node_ids": [...]}` batch body."""
+    if not isinstance(body, dict):
+        raise HttpError(400, "the body must be a json object")
+    keys = body.get("keys", [])
+    node_ids = body.get("node_ids", [])
+    if not isinstance(keys, list) or not isinstance(node_ids, list):
+        raise HttpError(400, "keys and node_ids must be lists")
+    if len(keys) + len(node_ids) > MAX_BATCH_SIZE:
+        raise HttpError(413, f"at most {MAX_BATCH_SIZE} keys and node ids per batch")
+    if not all(isinstance(node_id, str) for node_id in node_ids):
+        raise HttpError(400, "node ids must be strings")
+    # Keys that are not strings are invalid keys and get `{}` like the others.
+    return keys, [normalize_node_id(node_id) for node_id in node_ids]
+
+
+def node_id_or_none(key):
+    try:
+        return node_id_from_key(key)
+    except Exception:
+        return None
+
+
+def batch_response(keys, node_ids, statuses, key_map=map):
+    """
+    Return the `{"keys": [...], "node_ids": [...]}` response to a parsed batch, with the status of each entry in the
+    same order. Invalid keys get `{}`.
+
+    `statuses(node_ids)` returns the statuses of a list of node ids. The keys are turned into node ids with `key_map`,
+    e.g. the `map` of a thread pool to derive them in parallel.
+    """
+    derived_ids = list(key_map(node_id_or_none, keys))
+    found = iter(statuses([node_id for node_id in derived_ids if node_id is not None] + node_ids))
+    return {
+        "keys": [{} if node_id is None else dict(next(found), node_id=node_id) for node_id in derived_ids],
+        "node_ids": [dict(next(found), node_id=node_id) for node_id in node_ids],
+    }
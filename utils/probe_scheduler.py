@@ -0,0 +1,125 @@
+import heapq
+import logging
+import threading
+import time
+import traceback
+from concurrent.futures.thread import ThreadPoolExecutor
+
+logger = logging.getLogger("probe_scheduler")
+
+
+class _ProbeEntry:
+    __slots__ = ("node", "interval", "last_alive", "next_ts", "in_flight")
+
+    def __init__(self, node, interval, next_ts):
+        self.node = node
+        self.interval = interval
+        self.last_alive = None
+        self.next_ts = next_ts
+        self.in_flight = False
+
+
+class ProbeScheduler:
+    """
+    Probe every node on its own schedule instead of in hourly bursts.
+
+    Each node has a next-probe time in a heap. A node whose status changes (or that has never been probed) is
+    probed again after `min_interval`; every probe with an unchanged status doubles its interval up to
+    `max_interval`. Probes are dispatched at no more than `probes_per_second`, so load is spread evenly.
+    When probe results are recorded in fixed slots (see utils.uptime), `max_interval` must be below the slot size so
+    that stable nodes are still probed in every slot.
+
+    `probe(node)` returns a truthy value if the node is alive, and `on_result(node, alive, ts)` is called from
+    the worker thread after each probe.
+    """
+    def __init__(self, probe, on_result, probes_per_second=4, min_interval=300, max_interval=3000, max_workers=12):
+        self.probe = probe
+        self.on_result = on_result
+        self.probe_gap = 1 / probes_per_second
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._heap = []
+        self._entries = {}
+        self._cond = threading.Condition()
+        self._next_dispatch = 0
+
+    def add(self, node, ts=None):
+        """Schedule `node` if it is new (immediately, unless `ts` is given), or refresh its endpoint."""
+        with self._cond:
+            entry = self._entries.get(node.raw_id)
+            if entry is not None:
+                entry.node = node
+                return False
+            entry = self._entries[node.raw_id] = _ProbeEntry(node, self.min_interval, ts or time.time())
+            heapq.heappush(self._heap, (entry.next_ts, node.raw_id))
+            self._cond.notify()
+            return True
+
+    def probe_soon(self, raw_id):
+        with self._cond:
+            entry = self._entries.get(raw_id)
+            if entry is None or entry.in_flight:
+                return
+            entry.interval = self.min_interval
+            self._push(entry, time.time())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _push(self, entry, next_ts):
+        # Superseded heap items are skipped in `_pop_due` because their time no longer matches.
+        entry.next_ts = next_ts
+        heapq.heappush(self._heap, (next_ts, entry.node.raw_id))
+        self._cond.notify()
+
+    def _pop_due(self):
+        with self._cond:
+            while True:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                next_ts, raw_id = self._heap[0]
+                entry = self._entries[raw_id]
+                if entry.in_flight or entry.next_ts != next_ts:
+                    heapq.heappop(self._heap)
+                    continue
+                now = time.time()
+                if next_ts > now:
+                    self._cond.wait(next_ts - now)
+                    continue
+                heapq.heappop(self._heap)
+                entry.in_flight = True
+                return entry
+
+    def run(self):
+        while True:
+            entry = self._pop_due()
+            now = time.time()
+            if self._next_dispatch > now:
+                time.sleep(self._next_dispatch - now)
+            self._next_dispatch = max(now, self._next_dispatch) + self.probe_gap
+            self._executor.submit(self._probe_one, entry)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def _probe_one(self, entry):
+        try:
+            alive = bool(self.probe(entry.node))
+        except Exception:
+            logger.info(traceback.format_exc())
+            alive = False
+        now = time.time()
+        with self._cond:
+            if entry.last_alive is None or entry.last_alive != alive:
+                entry.interval = self.min_interval
+            else:
+                entry.interval = min(entry.interval * 2, self.max_interval)
+            entry.last_alive = alive
+            entry.in_flight = False
+            self._push(entry, now + entry.interval)
+        try:
+            self.on_result(entry.node, alive, now)
+        except Exception:
+            logger.warning(traceback.format_exc())
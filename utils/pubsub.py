@@ -1,72 +1,217 @@
 import asyncio
+import collections
+import itertools
 import json
+import logging
+
 import websockets
 
-from jsonrpcclient.clients.websockets_client import WebSocketsClient
-from jsonrpcclient.requests import Request
+logger = logging.getLogger("pubsub")
+
+# What to do with a new message when a subscription's queue is full.
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+# Most subscription ids whose notifications are buffered before the id is registered
+MAX_UNCLAIMED_IDS = 16
 
 
 class PubSubClient:
-    def __init__(self, url):
-        self.buffer = {}
+    """
+    A pub-sub client that multiplexes all subscriptions over one websocket.
+
+    A single reader task receives every frame: responses resolve the pending request with the same id and
+    notifications go to the bounded FIFO queue of their subscription. If the connection drops, the reader
+    reconnects with exponential backoff and subscribes again to every open subscription, retrying with backoff
+    until all of them are restored.
+    """
+    def __init__(self, url, queue_size=1024, overflow=DROP_OLDEST, min_backoff=0.5, max_backoff=30):
+        assert overflow in (DROP_OLDEST, DROP_NEWEST)
         self.url = url
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
         self.ws = None
+        # Map from the server's subscription id to the Subscription
+        self.subscriptions = {}
+        # Map from subscription id to the notifications received before the id was registered, which happens when
+        # they arrive before the response to `cfx_subscribe` is handled
+        self._unclaimed = collections.OrderedDict()
+        # Bumped on every new connection. Subscriptions made on an earlier connection are gone on the server.
+        self._generation = 0
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._reader = None
+        self._connected = None
+
+    async def _ensure_reader(self):
+        if self._reader is None:
+            self._connected = asyncio.Event()
+            self._reader = asyncio.ensure_future(self._run())
+        await self._connected.wait()
+
+    async def _run(self):
+        backoff = self.min_backoff
+        while True:
+            try:
+                self.ws = await websockets.connect(self.url)
+                backoff = self.min_backoff
+                self._generation += 1
+                self._unclaimed.clear()
+                self._connected.set()
+                asyncio.ensure_future(self._resubscribe(self._generation))
+                async for frame in self.ws:
+                    self._dispatch(json.loads(frame))
+                raise ConnectionError("connection closed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"pub-sub {self.url} disconnected: {e}, reconnect in {backoff}s")
+            self._connected.clear()
+            self.ws = None
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError(f"pub-sub {self.url} disconnected"))
+            self._pending.clear()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _dispatch(self, frame):
+        if "id" in frame and frame["id"] in self._pending:
+            fut = self._pending.pop(frame["id"])
+            if not fut.done():
+                if "error" in frame:
+                    fut.set_exception(RuntimeError(f"rpc error: {frame['error']}"))
+                else:
+                    fut.set_result(frame.get("result"))
+            return
+        params = frame.get("params")
+        if not params:
+            return
+        sub_id = params.get("subscription")
+        subscription = self.subscriptions.get(sub_id)
+        if subscription is not None:
+            subscription._deliver(params.get("result"))
+            return
+        unclaimed = self._unclaimed.get(sub_id)
+        if unclaimed is None:
+            # Notifications of ids that are never registered (e.g. just unsubscribed) must not pile up.
+            if len(self._unclaimed) >= MAX_UNCLAIMED_IDS:
+                self._unclaimed.popitem(last=False)
+            unclaimed = self._unclaimed[sub_id] = collections.deque(maxlen=self.queue_size)
+        unclaimed.append(params.get("result"))
+
+    def _register(self, subscription, sub_id, generation):
+        self.subscriptions.pop(subscription.sub_id, None)
+        subscription.sub_id = sub_id
+        subscription.generation = generation
+        self.subscriptions[sub_id] = subscription
+        for result in self._unclaimed.pop(sub_id, ()):
+            subscription._deliver(result)
+
+    async def _request(self, method, *params):
+        await self._ensure_reader()
+        request_id = next(self._ids)
+        fut = asyncio.get_event_loop().create_future()
+        self._pending[request_id] = fut
+        await self.ws.send(json.dumps({"jsonrpc": "2.0", "method": method, "params": list(params), "id": request_id}))
+        return await fut
+
+    async def _resubscribe(self, generation):
+        """Subscribe again on connection `generation` until every open subscription is restored or it is replaced."""
+        backoff = self.min_backoff
+        while generation == self._generation:
+            stale = [subscription for subscription in self.subscriptions.values()
+                     if subscription.generation != generation]
+            if len(stale) == 0:
+                return
+            failed = False
+            for subscription in stale:
+                await self._ensure_reader()
+                if generation != self._generation:
+                    return
+                try:
+                    new_id = await self._request("cfx_subscribe", subscription.topic, *subscription.args)
+                except Exception as e:
+                    logger.warning(f"resubscribe {subscription.topic} failed: {e}, retry in {backoff}s")
+                    failed = True
+                    break
+                if generation != self._generation:
+                    return
+                if subscription.closed:
+                    # Unsubscribed while this request was in flight.
+                    asyncio.ensure_future(self._unsubscribe(new_id))
+                    continue
+                self._register(subscription, new_id, generation)
+            if failed:
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+
+    async def _unsubscribe(self, sub_id):
+        try:
+            return await self._request("cfx_unsubscribe", sub_id)
+        except ConnectionError:
+            # The server drops the subscriptions of a closed connection anyway.
+            return True
 
     async def subscribe(self, topic, *args):
-        # connect if necessary
-        if self.ws is None:
-            self.ws = await websockets.connect(self.url)
-
-        # subscribe
-        req = Request("cfx_subscribe", topic, *args)
-        resp = await WebSocketsClient(self.ws).send(req)
-
-        # initialize buffer
-        sub_id = resp.data.result
-        self.buffer[sub_id] = []
-        return Subscription(self, sub_id)
+        await self._ensure_reader()
+        generation = self._generation
+        sub_id = await self._request("cfx_subscribe", topic, *args)
+        subscription = Subscription(self, sub_id, topic, args)
+        # If the connection was replaced meanwhile, `_resubscribe` restores it.
+        self._register(subscription, sub_id, generation)
+        return subscription
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
+        if self.ws is not None:
+            await self.ws.close()
+            self.ws = None
 
 
 class Subscription:
-    def __init__(self, pubsub, sub_id):
+    def __init__(self, pubsub, sub_id, topic, args):
         self.pubsub = pubsub
         self.sub_id = sub_id
+        self.topic = topic
+        self.args = args
+        self.queue = asyncio.Queue(maxsize=pubsub.queue_size)
+        self.dropped = 0
+        # The connection generation this subscription was made on
+        self.generation = None
+        self.closed = False
+
+    def _deliver(self, result):
+        if self.queue.full():
+            self.dropped += 1
+            if self.dropped & (self.dropped - 1) == 0:
+                logger.warning(f"subscription {self.topic} is full, {self.dropped} messages dropped")
+            if self.pubsub.overflow == DROP_NEWEST:
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait(result)
 
     async def unsubscribe(self):
-        assert (self.pubsub.ws is not None)
-
-        # unsubscribe
-        req = Request("cfx_unsubscribe", self.sub_id)
-        resp = await WebSocketsClient(self.pubsub.ws).send(req)
-        assert (resp.data.result)
-
-        # clear buffer
-        del self.pubsub.buffer[self.sub_id]
+        self.closed = True
+        self.pubsub.subscriptions.pop(self.sub_id, None)
+        if self.pubsub.ws is None or self.generation != self.pubsub._generation:
+            # Disconnected, or not restored yet: the server dropped this subscription with its connection.
+            return
+        result = await self.pubsub._unsubscribe(self.sub_id)
+        assert result
 
     async def next_wo_timeout(self):
-        # return buffered if possible
-        if len(self.pubsub.buffer[self.sub_id]) > 0:
-            return self.pubsub.buffer[self.sub_id].pop()
-
-        # receive new
-        while True:
-            resp = await self.pubsub.ws.recv()
-            resp = json.loads(resp)
-
-            recv_id = resp["params"]["subscription"]
-            result = resp["params"]["result"]
-
-            if recv_id == self.sub_id:
-                return result
-
-            self.pubsub.buffer[recv_id].append(result)
+        return await self.queue.get()
 
     async def next(self, timeout=1.0):
         try:
-            return await asyncio.wait_for(self.next_wo_timeout(), timeout=timeout)
+            return await asyncio.wait_for(self.queue.get(), timeout=timeout)
         except asyncio.TimeoutError:
             raise TimeoutError(
-                f"Received nothing on pub-sub {self.pubsub.url}/{self.sub_id} (node: {self.pubsub.nid}) for {timeout} seconds.")
+                f"Received nothing on pub-sub {self.pubsub.url}/{self.sub_id} ({self.topic}) for {timeout} seconds.")
 
     async def iter(self, timeout=0.5):
         while True:
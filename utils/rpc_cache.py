@@ -0,0 +1,170 @@
+import hashlib
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+
+logger = logging.getLogger("rpc_cache")
+
+# Do not use the cache at all
+PASSTHROUGH = "passthrough"
+# Serve hits from the cache, forward misses to the node and store their results
+RECORD = "record"
+# Serve everything cacheable from the cache and never call the node for it
+REPLAY = "replay"
+
+SEGMENT_SIZE = 64 << 20
+_HEADER = struct.Struct(">32sI")
+
+
+class RpcCacheMiss(Exception):
+    pass
+
+
+def epoch_of_param(epoch):
+    if isinstance(epoch, str) and epoch.startswith("0x"):
+        return int(epoch, 16)
+    return None
+
+
+def is_final_result(method, params, result, finalized_epoch):
+    """
+    Only results that can never change are cached: the reward info of an executed epoch and a block's data,
+    both only once the epoch is at or before `finalized_epoch`.
+    """
+    if method == "cfx_getBlockRewardInfo":
+        epoch = epoch_of_param(params[0]) if params else None
+        return bool(result) and epoch is not None and epoch <= finalized_epoch
+    if method == "cfx_getBlockByHash":
+        if not result or result.get("epochNumber") is None:
+            return False
+        return int(result["epochNumber"], 16) <= finalized_epoch
+    return False
+
+
+class RpcCache:
+    """
+    Content-addressed, on-disk cache of RPC results.
+
+    Entries are keyed by the sha256 of the method and params and appended, zlib-compressed, to segment files of
+    at most SEGMENT_SIZE bytes in `directory`. The key -> location index is rebuilt by scanning the segment
+    headers when the cache is opened.
+    """
+    CACHEABLE_METHODS = {"cfx_getBlockRewardInfo", "cfx_getBlockByHash"}
+
+    def __init__(self, directory, mode=RECORD, finalized_epoch=0):
+        assert mode in (PASSTHROUGH, RECORD, REPLAY)
+        self.directory = directory
+        self.mode = mode
+        self.finalized_epoch = finalized_epoch
+        self.hits = 0
+        self.misses = 0
+        self._index = {}
+        self._fds = {}
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_segment = None
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def key(method, params):
+        return hashlib.sha256(json.dumps([method, list(params)], separators=(",", ":")).encode()).digest()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:06d}.bin")
+
+    def _load(self):
+        segments = sorted(int(name[8:14]) for name in os.listdir(self.directory)
+                          if name.startswith("segment-") and name.endswith(".bin"))
+        for segment in segments:
+            path = self._segment_path(segment)
+            with open(path, "rb") as f:
+                offset = 0
+                while True:
+                    header = f.read(_HEADER.size)
+                    if len(header) < _HEADER.size:
+                        break
+                    key, length = _HEADER.unpack(header)
+                    data_offset = offset + _HEADER.size
+                    if data_offset + length > os.path.getsize(path):
+                        break
+                    self._index[key] = (segment, data_offset, length)
+                    f.seek(length, os.SEEK_CUR)
+                    offset = data_offset + length
+            if offset < os.path.getsize(path):
+                # Drop a record cut short by a crash.
+                logger.warning(f"truncate partial record at {path}:{offset}")
+                os.truncate(path, offset)
+        self._writer_segment = segments[-1] if segments else 0
+        logger.info(f"rpc cache {self.directory}: {len(self._index)} entries in {len(segments)} segments")
+
+    def _fd(self, segment):
+        fd = self._fds.get(segment)
+        if fd is None:
+            fd = self._fds[segment] = os.open(self._segment_path(segment), os.O_RDONLY)
+        return fd
+
+    def get(self, key):
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                return None
+            segment, offset, length = location
+            if self._writer is not None and segment == self._writer_segment:
+                self._writer.flush()
+            fd = self._fd(segment)
+        return json.loads(zlib.decompress(os.pread(fd, length, offset)))
+
+    def put(self, key, result):
+        data = zlib.compress(json.dumps(result, separators=(",", ":")).encode())
+        with self._lock:
+            if key in self._index:
+                return
+            if self._writer is None or self._writer.tell() + len(data) > SEGMENT_SIZE:
+                self._rotate()
+            self._writer.write(_HEADER.pack(key, len(data)))
+            offset = self._writer.tell()
+            self._writer.write(data)
+            self._index[key] = (self._writer_segment, offset, len(data))
+
+    def _rotate(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer_segment += 1
+        path = self._segment_path(self._writer_segment)
+        if os.path.exists(path) and os.path.getsize(path) >= SEGMENT_SIZE:
+            self._writer_segment += 1
+            path = self._segment_path(self._writer_segment)
+        self._writer = open(path, "ab")
+
+    def call(self, method, params, send):
+        """Return the result of `method(*params)`, using `send()` to call the node when needed."""
+        if self.mode == PASSTHROUGH or method not in self.CACHEABLE_METHODS:
+            return send()
+        key = self.key(method, params)
+        cached = self.get(key)
+        with self._lock:
+            if cached is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached is not None:
+            return cached
+        if self.mode == REPLAY:
+            raise RpcCacheMiss(f"{method}{tuple(params)} is not in the rpc cache {self.directory}")
+        result = send()
+        if is_final_result(method, params, result, self.finalized_epoch):
+            self.put(key, result)
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
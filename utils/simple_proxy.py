@@ -6,25 +6,33 @@ jsonrpcclient.client.response_log.propagate = False
 
 
 class SimpleRpcProxy:
-    def __init__(self, url, timeout):
+    def __init__(self, url, timeout, cache=None):
         self.url = url
         self.timeout = timeout
+        # An optional utils.rpc_cache.RpcCache for immutable results
+        self.cache = cache
         from jsonrpcclient.clients.http_client import HTTPClient
         self.client = HTTPClient(url)
 
     def __getattr__(self, name):
-        return RpcCaller(self.client, name, self.timeout)
+        return RpcCaller(self.client, name, self.timeout, self.cache)
 
 
 class RpcCaller:
-    def __init__(self, client, method, timeout):
+    def __init__(self, client, method, timeout, cache=None):
         self.client = client
         self.method = method
         self.timeout = timeout
+        self.cache = cache
 
     def __call__(self, *args, **argsn):
         if argsn:
             raise ValueError('json rpc 2 only supports array arguments')
+        if self.cache is not None:
+            return self.cache.call(self.method, args, lambda: self.send(*args))
+        return self.send(*args)
+
+    def send(self, *args):
         from jsonrpcclient.requests import Request
         request = Request(self.method, *args)
         try:
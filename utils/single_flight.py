@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # Set if the leader was interrupted, e.g. by KeyboardInterrupt, rather than failed
+        self.abandoned = False
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls with the same key into one computation, and optionally keep results for `ttl`
+    seconds (at most `max_size` of them, least recently used first out).
+
+    Keys should include whatever version the result depends on, so that a state change makes a new key.
+    """
+    def __init__(self, ttl=0, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._calls = {}
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                expiry, result = cached
+                if expiry > time.monotonic():
+                    self._results.move_to_end(key)
+                    return result
+                del self._results[key]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.abandoned:
+                return self.do(key, fn)
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException:
+            call.abandoned = True
+            raise
+        finally:
+            # Whatever happened, release the waiters and free the key.
+            with self._lock:
+                del self._calls[key]
+                if call.error is None and not call.abandoned and self.ttl > 0:
+                    self._results[key] = (time.monotonic() + self.ttl, call.result)
+                    if len(self._results) > self.max_size:
+                        self._results.popitem(last=False)
+            call.done.set()
+        return call.result
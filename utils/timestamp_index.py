@@ -0,0 +1,35 @@
+import bisect
+import threading
+
+
+class TimestampIndex:
+    """
+    Sorted index of the timestamps used as keys of a sqlitedict table.
+
+    The raw keys are kept next to their float values, because sqlitedict returns keys in their stored (string)
+    form and the same form has to be used to read the values back.
+    """
+    def __init__(self):
+        self.timestamps = []
+        self.keys = []
+        self._lock = threading.Lock()
+
+    def add(self, key):
+        ts = float(key)
+        with self._lock:
+            i = bisect.bisect_right(self.timestamps, ts)
+            self.timestamps.insert(i, ts)
+            self.keys.insert(i, key)
+
+    def nearest(self, ts):
+        """Return `(timestamp, key)` of the entry closest to `ts`, or None if the index is empty."""
+        with self._lock:
+            if not self.timestamps:
+                return None
+            i = bisect.bisect_left(self.timestamps, ts)
+            if i == len(self.timestamps) or (i > 0 and ts - self.timestamps[i - 1] <= self.timestamps[i] - ts):
+                i -= 1
+            return self.timestamps[i], self.keys[i]
+
+    def __len__(self):
+        return len(self.timestamps)
@@ -0,0 +1,180 @@
+"""
+Minimal discovery-protocol UDP ping, used to check that a node's discovery port answers.
+
+Packets follow the discovery wire format of conflux-rust:
+    protocol(1) | hash(32) | signature(65) | packet_id(1) | rlp(payload)
+where `hash = keccak(signature | packet_id | rlp)` and the signature signs `keccak(packet_id | rlp)`.
+The sender's node id is recovered from the signature, so replies are matched by node id.
+"""
+import asyncio
+import ipaddress
+import logging
+import os
+import time
+
+import rlp
+
+from utils.utils import (big_endian_to_int, ecrecover_to_pub, ecsign, encode_hex, int_to_big_endian, priv_to_pub,
+                         sha3_256)
+
+logger = logging.getLogger("udp_discovery")
+
+UDP_PROTOCOL_DISCOVERY = 1
+PACKET_PING = 1
+PACKET_PONG = 2
+EXPIRY_SECONDS = 20
+
+
+class DiscoveryPacketError(Exception):
+    pass
+
+
+def encode_endpoint(ip, udp_port, tcp_port):
+    return [ipaddress.ip_address(ip).packed, int(udp_port), int(tcp_port)]
+
+
+def assemble_packet(packet_id, payload, priv_key):
+    body = bytes([packet_id]) + rlp.encode(payload)
+    v, r, s = ecsign(sha3_256(body), priv_key)
+    signature = r.to_bytes(32, "big") + s.to_bytes(32, "big") + bytes([v - 27])
+    packet_hash = sha3_256(signature + body)
+    return bytes([UDP_PROTOCOL_DISCOVERY]) + packet_hash + signature + body, packet_hash
+
+
+def decode_packet(data):
+    """Return `(node_id, packet_hash, packet_id, payload)` of a discovery packet, or raise DiscoveryPacketError."""
+    if len(data) < 1 + 32 + 65 + 1 or data[0] != UDP_PROTOCOL_DISCOVERY:
+        raise DiscoveryPacketError("not a discovery packet")
+    packet_hash = data[1:33]
+    signed = data[33:]
+    if sha3_256(signed) != packet_hash:
+        raise DiscoveryPacketError("hash mismatch")
+    signature, body = signed[:65], signed[65:]
+    r = big_endian_to_int(signature[:32])
+    s = big_endian_to_int(signature[32:64])
+    pub, _, _ = ecrecover_to_pub(sha3_256(body), signature[64] + 27, r, s)
+    try:
+        payload = rlp.decode(body[1:])
+    except Exception as e:
+        raise DiscoveryPacketError(f"invalid rlp: {e}")
+    return encode_hex(pub), packet_hash, body[0], payload
+
+
+def ping_packet(priv_key, local_endpoint, node):
+    payload = [
+        local_endpoint,
+        encode_endpoint(node.ip, node.udp_port, node.tcp_port),
+        int_to_big_endian(int(time.time()) + EXPIRY_SECONDS),
+    ]
+    return assemble_packet(PACKET_PING, payload, priv_key)
+
+
+def pong_packet(priv_key, to_endpoint, ping_hash):
+    payload = [to_endpoint, ping_hash, int_to_big_endian(int(time.time()) + EXPIRY_SECONDS)]
+    return assemble_packet(PACKET_PONG, payload, priv_key)[0]
+
+
+class _PingProtocol(asyncio.DatagramProtocol):
+    def __init__(self, expected):
+        # Map from node id to the hash of the ping sent to it
+        self.expected = expected
+        self.replied = set()
+        # Set once every ping is sent, so that `done` does not resolve while some are still to be sent.
+        self.all_sent = False
+        self.done = asyncio.get_event_loop().create_future()
+
+    def finish_sending(self):
+        self.all_sent = True
+        self._check_done()
+
+    def _check_done(self):
+        if self.all_sent and len(self.replied) == len(self.expected) and not self.done.done():
+            self.done.set_result(None)
+
+    def datagram_received(self, data, addr):
+        try:
+            node_id, _, packet_id, payload = decode_packet(data)
+        except Exception as e:
+            logger.debug(f"drop udp packet from {addr}: {e}")
+            return
+        if packet_id != PACKET_PONG or len(payload) < 2:
+            return
+        if self.expected.get(node_id) == payload[1]:
+            self.replied.add(node_id)
+            self._check_done()
+
+
+async def udp_ping_all(nodes, priv_key=None, timeout=3, send_rate=2000, local_addr=("0.0.0.0", 0)):
+    """
+    Ping all `nodes` (NodeEndpoint values) from one socket and return the set of node ids that replied
+    with a matching pong within `timeout` seconds.
+    """
+    priv_key = priv_key or os.urandom(32)
+    loop = asyncio.get_event_loop()
+    expected = {}
+    protocol = _PingProtocol(expected)
+    transport, _ = await loop.create_datagram_endpoint(lambda: protocol, local_addr=local_addr)
+    try:
+        local_port = transport.get_extra_info("sockname")[1]
+        local_endpoint = encode_endpoint("0.0.0.0", local_port, 0)
+        for i, node in enumerate(nodes):
+            try:
+                packet, packet_hash = ping_packet(priv_key, local_endpoint, node)
+            except ValueError:
+                logger.info(f"node {node.node_id} has invalid endpoint {node.ip}:{node.udp_port}")
+                continue
+            expected[node.node_id] = packet_hash
+            transport.sendto(packet, (str(node.ip), int(node.udp_port)))
+            if (i + 1) % send_rate == 0:
+                await asyncio.sleep(1)
+        protocol.finish_sending()
+        if expected:
+            try:
+                await asyncio.wait_for(asyncio.shield(protocol.done), timeout)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        transport.close()
+    return protocol.replied
+
+
+class _ResponderProtocol(asyncio.DatagramProtocol):
+    def __init__(self, priv_key):
+        self.priv_key = priv_key
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            _, packet_hash, packet_id, payload = decode_packet(data)
+        except Exception:
+            return
+        if packet_id == PACKET_PING:
+            to_endpoint = encode_endpoint(addr[0], addr[1], 0)
+            self.transport.sendto(pong_packet(self.priv_key, to_endpoint, packet_hash), addr)
+
+
+class UdpResponder:
+    """
+    A local stand-in for a node's discovery port that answers every ping with a signed pong.
+    Used by tests and benchmarks instead of a real node.
+    """
+    def __init__(self, priv_key=None, host="127.0.0.1", port=0):
+        self.priv_key = priv_key or os.urandom(32)
+        self.node_id = encode_hex(priv_to_pub(self.priv_key))
+        self.host = host
+        self.port = port
+        self.transport = None
+
+    async def start(self):
+        loop = asyncio.get_event_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: _ResponderProtocol(self.priv_key), local_addr=(self.host, self.port))
+        self.port = self.transport.get_extra_info("sockname")[1]
+        return self
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
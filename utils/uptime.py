@@ -0,0 +1,103 @@
+import threading
+import time
+
+
+def popcount(x):
+    return bin(x).count("1")
+
+
+def longest_run(x):
+    # Each iteration shortens every run of 1 bits by one, so the number of
+    # iterations is the length of the longest run.
+    n = 0
+    while x:
+        x &= x >> 1
+        n += 1
+    return n
+
+
+class NodeUptime:
+    __slots__ = ("probed", "alive")
+
+    def __init__(self):
+        # Bit i is set if the node was probed (resp. alive) in slot i.
+        self.probed = 0
+        self.alive = 0
+
+
+class UptimeHistory:
+    """
+    Per-node probe history with one bit per sweep slot.
+
+    Time is divided into fixed slots of `slot_seconds` starting at `origin`, and each node keeps two bitmaps
+    (stored as Python ints): the slots in which it was probed and the slots in which it was alive.
+    Window queries mask the bitmaps and use popcount, so they never look at individual probes.
+
+    A bitmap has one bit per slot since `origin`, so `origin` should be the start of the recorded history rather
+    than a fixed epoch. If it is not given, it is the start of the slot of the first record. Records before
+    `origin` are ignored.
+    """
+    def __init__(self, slot_seconds, origin=None):
+        self.slot_seconds = slot_seconds
+        self.origin = origin
+        self.nodes = {}
+        self._lock = threading.Lock()
+
+    def slot_of(self, ts):
+        if self.origin is None:
+            return 0
+        return max(0, int((ts - self.origin) // self.slot_seconds))
+
+    def record(self, node_id, ts, alive):
+        with self._lock:
+            if self.origin is None:
+                self.origin = ts - ts % self.slot_seconds
+            if ts < self.origin:
+                return
+            bit = 1 << self.slot_of(ts)
+            node = self.nodes.get(node_id)
+            if node is None:
+                node = self.nodes[node_id] = NodeUptime()
+            node.probed |= bit
+            if alive:
+                node.alive |= bit
+
+    def record_sweep(self, ts, probed_ids, alive_ids):
+        alive_ids = set(alive_ids)
+        for node_id in probed_ids:
+            self.record(node_id, ts, node_id in alive_ids)
+        for node_id in alive_ids:
+            self.record(node_id, ts, True)
+
+    def _window_mask(self, start, end):
+        # Nothing is recorded outside [origin, now], and clamping bounds the mask to the recorded history.
+        if self.origin is None:
+            return 0, 0
+        start = max(start, self.origin)
+        end = min(end, time.time())
+        if end < start:
+            return 0, 0
+        first = self.slot_of(start)
+        last = self.slot_of(end)
+        if last < first:
+            return 0, 0
+        return ((1 << (last - first + 1)) - 1) << first, first
+
+    def query(self, node_id, start, end):
+        mask, first = self._window_mask(start, end)
+        with self._lock:
+            node = self.nodes.get(node_id)
+            if node is None:
+                probed = alive = 0
+            else:
+                probed = node.probed & mask
+                alive = node.alive & mask
+        probed_slots = popcount(probed)
+        alive_slots = popcount(alive)
+        return {
+            "probed_slots": probed_slots,
+            "alive_slots": alive_slots,
+            "availability": alive_slots / probed_slots if probed_slots else 0.0,
+            "longest_streak": longest_run(alive >> first),
+            "uptime": alive_slots * self.slot_seconds,
+        }
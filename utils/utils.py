@@ -1,8 +1,6 @@
-import datetime
 import inspect
 import logging
 import re
-import sys
 import time
 
 import sha3 as _sha3
@@ -15,6 +13,9 @@ from rlp.utils import ALL_BYTES
 import random
 import coincurve
 
+# Moved to utils.common, which the HTTP workers import without the libraries above.
+from utils.common import http_rpc_url, parse_date, pubsub_url, setup_log
+
 logger = logging.getLogger("utils")
 
 # Assert functions
@@ -107,14 +108,6 @@ def assert_array_result(object_array,
         raise AssertionError("Objects were found %s" % (str(to_match)))
 
 
-def pubsub_url(host="127.0.0.1", port=12535):
-    return "ws://%s:%d" % (host, int(port))
-
-
-def http_rpc_url(host="127.0.0.1", port=12537):
-    return "http://%s:%d" % (host, int(port))
-
-
 def checktx(node, tx_hash):
     return node.cfx_getTransactionReceipt(tx_hash) is not None
 
@@ -152,23 +145,6 @@ def wait_until(predicate,
     raise RuntimeError('Unreachable')
 
 
-def setup_log():
-    fh = logging.FileHandler("server.log")
-    ch = logging.StreamHandler(sys.stdout)
-    formatter = logging.Formatter(
-        fmt=
-        '%(asctime)s.%(msecs)03dZ %(name)s %(process)d %(thread)d (%(levelname)s): %(message)s',
-        datefmt='%Y-%m-%dT%H:%M:%S')
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-    ch.setLevel("INFO")
-    fh.setLevel("DEBUG")
-    logging.root.addHandler(ch)
-    logging.root.addHandler(fh)
-    logging.root.setLevel("DEBUG")
-
-
-
 def sha3_256(x): return _sha3.keccak_256(x).digest()
 
 
@@ -757,7 +733,3 @@ class bcolors:
     ENDC = '\033[0m'
     BOLD = '\033[1m'
     UNDERLINE = '\033[4m'
-
-
-def parse_date(s):
-    return time.mktime(datetime.datetime.strptime(s, "%H:%M-%d/%m/%Y").timetuple())
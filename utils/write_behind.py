@@ -0,0 +1,192 @@
+import bisect
+import logging
+import threading
+import time
+import traceback
+
+logger = logging.getLogger("write_behind")
+
+_PUT = 0
+_DELETE = 1
+_DONE = 2
+_RESET = 3
+# Longest wait between retries of a failed group commit
+MAX_RETRY_DELAY = 30
+
+
+class WriteBehind:
+    """
+    Group commit for SqliteDicts opened with autocommit=False.
+
+    Writes from any thread are queued and applied in order by one committer thread, which commits every touched db
+    once per `max_rows` queued rows or `max_delay` seconds, whichever comes first.
+
+    Progress is tracked per unit (e.g. an epoch): `done(n)` tells that everything of unit `n` has been queued. The
+    watermark, saved at `watermark_key` in `watermark_db`, is the highest n such that all units up to n are done, and
+    the units done above it are saved at `done_key` as a list of `[first, last]` ranges, so that a gap does not hold
+    back the others. Both are saved and committed only after the data queued before those `done` calls, so every
+    unit they cover is durable.
+
+    A failed group commit is logged, kept as `error`, and retried with backoff until it succeeds. Nothing queued
+    after it is committed meanwhile, so the writes stay in order.
+    """
+    def __init__(self, watermark_db, watermark_key, watermark, done_key=None, max_rows=2000, max_delay=0.1):
+        self.watermark_db = watermark_db
+        self.watermark_key = watermark_key
+        self.done_key = done_key
+        # The latest committed watermark
+        self.watermark = watermark
+        # Sorted, disjoint and non-adjacent [first, last] ranges of the units done above the watermark
+        self._done = [] if done_key is None else \
+            [[max(first, watermark + 1), last] for first, last in watermark_db.get(done_key, []) if last > watermark]
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        # List of (kind, db, key, value) not applied yet
+        self._ops = []
+        self._first_queued_at = 0
+        self._queued = 0
+        self._committed = 0
+        # The error of the latest group commit if it failed, or None
+        self.error = None
+        self._cond = threading.Condition()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def _queue(self, ops):
+        with self._cond:
+            if len(self._ops) == 0:
+                self._first_queued_at = time.monotonic()
+            self._ops.extend(ops)
+            self._queued += len(ops)
+            if len(self._ops) >= self.max_rows:
+                self._cond.notify_all()
+
+    def put(self, db, key, value):
+        self._queue([(_PUT, db, key, value)])
+
+    def update(self, db, items):
+        self._queue([(_PUT, db, key, value) for key, value in items])
+
+    def delete(self, db, key):
+        self._queue([(_DELETE, db, key, None)])
+
+    def done(self, n):
+        self._queue([(_DONE, None, n, None)])
+
+    def reset(self, n):
+        """Move the watermark back to `n` if it is above, e.g. after the units above `n` were deleted."""
+        self._queue([(_RESET, None, n, None)])
+
+    def is_done(self, n):
+        """Whether unit `n` is done and committed."""
+        with self._cond:
+            if n <= self.watermark:
+                return True
+            i = bisect.bisect_right(self._done, [n, float("inf")]) - 1
+            return i >= 0 and self._done[i][1] >= n
+
+    def flush(self):
+        """Block until everything queued so far is committed."""
+        with self._cond:
+            target = self._queued
+            self._first_queued_at = float("-inf")
+            self._cond.notify_all()
+            while self._committed < target:
+                self._cond.wait()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if len(self._ops) != 0:
+                        delay = self._first_queued_at + self.max_delay - time.monotonic()
+                        if len(self._ops) >= self.max_rows or delay <= 0:
+                            break
+                    else:
+                        delay = None
+                    self._cond.wait(delay)
+                ops = self._ops
+                self._ops = []
+                target = self._queued
+            retry_delay = self.max_delay
+            while True:
+                try:
+                    self._commit(ops)
+                    break
+                except Exception as e:
+                    # Writing the same rows again is harmless, so the whole group is retried.
+                    self.error = e
+                    logger.error(f"group commit of {len(ops)} rows failed, retrying in {retry_delay}s: "
+                                 f"{traceback.format_exc()}")
+                    time.sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2, MAX_RETRY_DELAY)
+            self.error = None
+            with self._cond:
+                self._committed = target
+                self._cond.notify_all()
+
+    def _commit(self, ops):
+        # Map from id to db, by identity since SqliteDicts compare by content
+        touched = {}
+        batch_db = None
+        batch = {}
+        for kind, db, key, value in ops:
+            if db is not None:
+                touched[id(db)] = db
+            if kind == _PUT and db is batch_db:
+                batch[key] = value
+                continue
+            # Consecutive puts to the same db are written with one `update`.
+            if len(batch) != 0:
+                batch_db.update(batch)
+            batch_db, batch = None, {}
+            if kind == _PUT:
+                batch_db, batch = db, {key: value}
+            elif kind == _DELETE:
+                try:
+                    del db[key]
+                except KeyError:
+                    pass
+        if len(batch) != 0:
+            batch_db.update(batch)
+        for db in touched.values():
+            db.commit(blocking=True)
+
+        watermark = self.watermark
+        done = [list(r) for r in self._done]
+        for kind, _, key, _ in ops:
+            if kind == _DONE:
+                if key > watermark:
+                    _add_to_ranges(done, key)
+            elif kind == _RESET:
+                watermark = min(watermark, key)
+                done = [[first, min(last, key)] for first, last in done if first <= key]
+        if len(done) != 0 and done[0][0] == watermark + 1:
+            watermark = done.pop(0)[1]
+        if watermark != self.watermark or done != self._done:
+            self.watermark_db[self.watermark_key] = watermark
+            if self.done_key is not None:
+                self.watermark_db[self.done_key] = done
+            self.watermark_db.commit(blocking=True)
+            with self._cond:
+                self.watermark = watermark
+                self._done = done
+
+
+def _add_to_ranges(ranges, n):
+    """Add `n` to the sorted, disjoint and non-adjacent [first, last] `ranges`."""
+    i = bisect.bisect_right(ranges, [n, float("inf")])
+    if i > 0 and ranges[i - 1][1] >= n:
+        return
+    joins_previous = i > 0 and ranges[i - 1][1] == n - 1
+    joins_next = i < len(ranges) and ranges[i][0] == n + 1
+    if joins_previous and joins_next:
+        ranges[i - 1][1] = ranges[i][1]
+        del ranges[i]
+    elif joins_previous:
+        ranges[i - 1][1] = n
+    elif joins_next:
+        ranges[i][0] = n
+    else:
+        ranges.insert(i, [n, n])